@@ -0,0 +1,161 @@
+"""
+Measure how long the serving path takes to start.
+
+Each measurement runs in a fresh interpreter, so nothing is already
+imported. Reports the time to import the server, to load a configuration
+from YAML and from a compiled snapshot, to assign a first user and to
+unpickle a report as sent by the report worker, and checks that none of
+this pulls in numpy or scipy.
+
+    python benchmarks/import_time.py [configuration directory]
+"""
+
+import sys
+import json
+import pickle
+import shutil
+import pathlib
+import tempfile
+import subprocess
+
+import numpy
+
+from needle.models import evaluate_model
+from needle.report import kpi_result
+from needle.configuration import Configuration
+
+
+MEASURE = '''
+import sys
+import json
+import time
+import pickle
+import pathlib
+import datetime
+
+start = time.perf_counter()
+
+import needle.app
+
+imported = time.perf_counter()
+
+from needle.configuration import Configuration
+from needle.experiment import user_experiments
+
+configuration = Configuration(pathlib.Path(sys.argv[1]))
+
+loaded = time.perf_counter()
+
+list(user_experiments(1, datetime.date.today(), configuration))
+
+assigned = time.perf_counter()
+
+with open(sys.argv[2], 'rb') as f:
+    pickle.load(f)
+
+unpickled = time.perf_counter()
+
+print(json.dumps({
+    'import': imported - start,
+    'configuration': loaded - imported,
+    'first user': assigned - loaded,
+    'report': unpickled - assigned,
+    'analysis stack loaded': sorted(
+        x for x in ('numpy', 'scipy') if x in sys.modules
+    ),
+}))
+'''
+
+
+def write_report(root, path):
+    # Every KPI in the configuration, on synthetic data, through the same
+    # code as the report worker
+    random = numpy.random.RandomState(0)
+
+    def run_query(sql, users):
+        values = random.gamma(2, 50, len(users))
+
+        if sql.startswith('SELECT COUNT(value)'):
+            return [(len(values), values.sum(), (values ** 2).sum())]
+
+        return [(x,) for x in values]
+
+    branches = {
+        'control': range(0, 1000),
+        'test': range(1000, 2000),
+    }
+
+    report = [
+        kpi_result(kpi, evaluate_model(
+            branches,
+            kpi.model,
+            kpi.sql,
+            run_query,
+            mixing_variance=1,
+            prob_improvement=kpi.prob_improvement,
+        ), 0.0)
+        for kpi in Configuration(root, use_snapshot=False).kpis.values()
+    ]
+
+    with path.open('wb') as f:
+        pickle.dump(report, f)
+
+
+def measure(root, report_path, repeats=5):
+    runs = [
+        json.loads(subprocess.check_output(
+            (sys.executable, '-c', MEASURE, str(root), str(report_path)),
+        ).decode('utf-8'))
+        for x in range(repeats)
+    ]
+
+    # Best of the runs, which is least disturbed by the rest of the machine
+    return {
+        key: (
+            min(run[key] for run in runs)
+            if key != 'analysis stack loaded'
+            else runs[0][key]
+        )
+        for key in runs[0]
+    }
+
+
+def report(label, timings):
+    print(label)
+
+    for key, value in timings.items():
+        if isinstance(value, float):
+            print("  %-22s %7.1f ms" % (key, value * 1000))
+        else:
+            print("  %-22s %s" % (key, ", ".join(value) or "no"))
+
+
+def main(source):
+    with tempfile.TemporaryDirectory() as directory:
+        root = pathlib.Path(directory) / 'configuration'
+        shutil.copytree(str(source), str(root))
+
+        report_path = pathlib.Path(directory) / 'report.pickle'
+        write_report(root, report_path)
+
+        timings = measure(root, report_path)
+        report("From YAML (with parse cache)", timings)
+
+        subprocess.check_call(
+            (sys.executable, '-m', 'needle', 'compile', str(root)),
+        )
+
+        snapshot_timings = measure(root, report_path)
+        report("From snapshot", snapshot_timings)
+
+    loaded = (
+        timings['analysis stack loaded'] +
+        snapshot_timings['analysis stack loaded']
+    )
+
+    if loaded:
+        sys.exit("Serving path loaded %s" % ", ".join(sorted(set(loaded))))
+
+
+if __name__ == '__main__':
+    main(pathlib.Path(sys.argv[1] if len(sys.argv) > 1 else 'example'))
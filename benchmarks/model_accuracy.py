@@ -0,0 +1,97 @@
+"""
+Compare the analytic and sketch models against the bootstrap models they
+replace.
+
+Draws log-normally distributed "order values" for a control and a test
+branch, and prints each model's posterior summary, P(positive) under both
+the normal approximation and sampling, and the time taken, so the answers
+can be compared side by side.
+
+    python benchmarks/model_accuracy.py [sample size]
+"""
+
+import sys
+import time
+
+import numpy
+
+from needle.models import (
+    LogNormalModel,
+    MeanBootstrapModel,
+    MedianBootstrapModel,
+    MedianSketchModel,
+    NormalModel,
+    calculate_prob_improvement,
+    calculate_sampled_prob_improvement,
+)
+
+
+SEED_SAMPLES = [90.0, 95.0, 100.0, 105.0, 110.0]
+
+COMPARISONS = (
+    ("mean", (
+        MeanBootstrapModel(SEED_SAMPLES),
+        NormalModel({'mean': 100.0, 'variance': 2500.0, 'weight': 5}),
+        LogNormalModel({'mean': 4.5, 'variance': 0.25, 'weight': 5}),
+    )),
+    ("median", (
+        MedianBootstrapModel(SEED_SAMPLES),
+        MedianSketchModel({'samples': SEED_SAMPLES}),
+    )),
+)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main(sample_size):
+    random = numpy.random.RandomState(1)
+
+    control = random.lognormal(4.5, 0.5, size=sample_size)
+    test = random.lognormal(4.52, 0.5, size=sample_size)
+
+    print("Sample size: %d per branch" % sample_size)
+
+    for statistic, models in COMPARISONS:
+        print()
+        print("Statistic: %s" % statistic)
+
+        for model in models:
+            control_posterior, control_time = timed(
+                model.analyse_samples,
+                control,
+            )
+            test_posterior, test_time = timed(model.analyse_samples, test)
+
+            p_positive, p_negative = calculate_prob_improvement(
+                control_posterior,
+                test_posterior,
+            )
+            sampled_p_positive, sampled_p_negative = (
+                calculate_sampled_prob_improvement(
+                    control_posterior,
+                    test_posterior,
+                )
+            )
+
+            print(
+                "  %-22s mean %9.4f  std %7.4f  "
+                "5%%-95%% [%9.4f, %9.4f]  "
+                "P(positive) %.4f (sampled %.4f)  %.3fs" % (
+                    model.name,
+                    test_posterior.mean,
+                    test_posterior.std,
+                    test_posterior.percentiles[5],
+                    test_posterior.percentiles[95],
+                    p_positive,
+                    sampled_p_positive,
+                    control_time + test_time,
+                ),
+            )
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,136 @@
+"""
+Measure /user latency under concurrent load.
+
+Starts the server (without the report worker) in a subprocess, then issues
+requests for random users from a number of concurrent clients and prints
+the p50 and p99 latencies and the overall throughput.
+
+    python benchmarks/user_latency.py [configuration directory]
+        [--requests N] [--concurrency N] [--port N]
+"""
+
+import sys
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+
+import aiohttp
+
+
+SERVE = '''
+import sys
+import pathlib
+import aiohttp.web
+
+from needle.app import get_app
+
+aiohttp.web.run_app(
+    get_app(pathlib.Path(sys.argv[1])),
+    host='127.0.0.1',
+    port=int(sys.argv[2]),
+)
+'''
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description="Benchmark /user latency")
+
+    parser.add_argument("dir", nargs='?', default='example')
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--port", type=int, default=12121)
+
+    return parser
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(
+        int(fraction * len(sorted_values)),
+        len(sorted_values) - 1,
+    )]
+
+
+async def wait_for_server(session, url):
+    for attempt in range(100):
+        try:
+            async with session.get(url) as response:
+                await response.read()
+                return
+        except aiohttp.ClientError:
+            await asyncio.sleep(0.1)
+
+    raise RuntimeError("Server did not start")
+
+
+async def client(session, url, requests, latencies):
+    while requests:
+        requests.pop()
+
+        params = {
+            'user-id': random.randrange(10 ** 6),
+            'user-signup-date': '2016-%02d-%02d' % (
+                random.randint(1, 12),
+                random.randint(1, 28),
+            ),
+        }
+
+        start = time.perf_counter()
+
+        async with session.get(url, params=params) as response:
+            await response.read()
+
+            if response.status != 200:
+                raise RuntimeError("Got status %d" % response.status)
+
+        latencies.append(time.perf_counter() - start)
+
+
+async def benchmark(options):
+    url = 'http://127.0.0.1:%d/user' % options.port
+
+    requests = list(range(options.requests))
+    latencies = []
+
+    async with aiohttp.ClientSession() as session:
+        await wait_for_server(session, 'http://127.0.0.1:%d/' % options.port)
+
+        start = time.perf_counter()
+
+        await asyncio.gather(*(
+            client(session, url, requests, latencies)
+            for x in range(options.concurrency)
+        ))
+
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    print("Requests:    %d (%d concurrent)" % (
+        len(latencies),
+        options.concurrency,
+    ))
+    print("Throughput:  %.0f requests/s" % (len(latencies) / elapsed))
+    print("p50 latency: %.2f ms" % (1000 * percentile(latencies, 0.50)))
+    print("p99 latency: %.2f ms" % (1000 * percentile(latencies, 0.99)))
+
+
+def main(args=sys.argv[1:]):
+    options = argument_parser().parse_args(args)
+
+    server = subprocess.Popen(
+        (sys.executable, '-c', SERVE, options.dir, str(options.port)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    try:
+        asyncio.get_event_loop().run_until_complete(benchmark(options))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
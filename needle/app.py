@@ -1,13 +1,15 @@
+import re
 import json
 import uuid
-import jinja2
+import signal
 import aiohttp.web
 import asyncio
 import logging
-import dateutil.parser
+import contextlib
+import datetime
 import functools
-import concurrent.futures
 
+from .scheduler import ReportScheduler
 from .experiment import user_experiments
 
 
@@ -17,12 +19,23 @@ logger = logging.getLogger(__name__)
 current_results = {}
 
 
+CONFIGURATION_RELOAD_INTERVAL = 10
+
+
+ISO_8601_DATE = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?'
+    r'(?:Z|[+-]\d{2}:?\d{2})?)?$',
+)
+
+
 def filter_percent(value):
     return '%.1f%%' % (100 * value)
 
 
 @functools.lru_cache(maxsize=1)
 def get_template_environment():
+    import jinja2  # Lazy-load
+
     environment = jinja2.Environment(
         loader=jinja2.PackageLoader('needle', 'templates'),
         auto_reload=True,
@@ -43,8 +56,21 @@ def get_template(name):
 
 
 def get_configuration(request):
-    from .configuration import Configuration  # Lazy-load
-    return Configuration(request.app['root'])
+    # Preloaded, and replaced by bg_reload_configuration when it changes
+    return request.app['configuration']
+
+
+def parse_date(text, *, lenient=False):
+    match = ISO_8601_DATE.match(text)
+
+    if match is not None:
+        return datetime.date(*(int(x) for x in match.groups()))
+
+    if not lenient:
+        raise ValueError("Not an ISO 8601 date: %r" % text)
+
+    import dateutil.parser  # Lazy-load
+    return dateutil.parser.parse(text).date()
 
 
 def send_template(
@@ -85,8 +111,9 @@ async def experiments(request):
 async def lookup_user(request):
     try:
         user_id = int(request.GET['user-id'])
-        signup_date = dateutil.parser.parse(
+        signup_date = parse_date(
             request.GET['user-signup-date'],
+            lenient=request.app['lenient_dates'],
         )
     except (ValueError, KeyError):
         return aiohttp.web.Response(
@@ -96,6 +123,7 @@ async def lookup_user(request):
         )
 
     config = get_configuration(request)
+    exposures = request.app['exposures']
 
     experiment_parameters = dict(config.defaults)
 
@@ -107,6 +135,10 @@ async def lookup_user(request):
         configuration=config,
     ):
         experiment_parameters.update(branch.parameters)
+
+        if exposures is not None:
+            exposures.record(user_id, experiment.name, branch.name)
+
         debug_experiments.append({
             'site-area': experiment.site_area,
             'experiment': experiment.name,
@@ -130,7 +162,45 @@ async def lookup_user(request):
     )
 
 
-def get_app(root, *, debug=False):
+async def exposure_metrics(request):
+    exposures = request.app['exposures']
+
+    if exposures is None:
+        response = {'enabled': False}
+    else:
+        response = {'enabled': True, **exposures.metrics()}
+
+    return aiohttp.web.Response(
+        status=200,
+        content_type='application/json',
+        body=json.dumps(response).encode('utf-8'),
+    )
+
+
+async def refresh(request):
+    scheduler = request.app['scheduler']
+    experiment = request.GET.get('experiment')
+
+    scheduler.refresh(experiment)
+
+    response = {
+        'refreshing': experiment,
+        'schedules': {
+            name: schedule.as_dict()
+            for name, schedule in scheduler.schedules.items()
+        },
+    }
+
+    return aiohttp.web.Response(
+        status=202,
+        content_type='application/json',
+        body=json.dumps(response).encode('utf-8'),
+    )
+
+
+def get_app(root, *, debug=False, lenient_dates=False):
+    from .configuration import Configuration  # Lazy-load
+
     app = aiohttp.web.Application(
         logger=logger,
         debug=debug,
@@ -138,33 +208,95 @@ def get_app(root, *, debug=False):
     app.router.add_route('GET', '/', site_root)
     app.router.add_route('GET', '/user', lookup_user)
     app.router.add_route('GET', '/experiments', experiments)
+    app.router.add_route('POST', '/refresh', refresh)
+    app.router.add_route('GET', '/exposures', exposure_metrics)
     app['root'] = root
+    app['configuration'] = Configuration(root)
+    app['lenient_dates'] = lenient_dates
+    app['exposures'] = None
     return app
 
 
-def bg_run_reports(path):
+def reload_configuration(configuration):
+    from .configuration import Configuration  # Lazy-load
+
+    if configuration.is_stale():
+        return Configuration(configuration.path)
+
+    changed_files = configuration.changed_experiment_files()
+
+    if changed_files:
+        return configuration.reload_experiment_files(changed_files)
+
+    return None
+
+
+def bg_reload_configuration(loop, app):
+    # File I/O and YAML parsing happen in a thread, off the event loop
+    future = loop.run_in_executor(
+        None,
+        reload_configuration,
+        app['configuration'],
+    )
+
+    def reloaded(future):
+        try:
+            configuration = future.result()
+        except Exception:
+            logger.exception("Could not reload configuration")
+            configuration = None
+
+        if configuration is not None:
+            app['configuration'] = configuration
+
+        loop.call_later(
+            CONFIGURATION_RELOAD_INTERVAL,
+            bg_reload_configuration,
+            loop,
+            app,
+        )
+    future.add_done_callback(reloaded)
+
+
+def bg_run_reports(path, skip=()):
     from .report import run_all_reports  # Lazy load
     from .configuration import Configuration  # Lazy-load
     import logging
     logging.basicConfig(level=logging.DEBUG)
     config = Configuration(path)
-    return run_all_reports(config)
+    return run_all_reports(config, skip=skip)
+
 
+def run(
+    root,
+    *,
+    host='::',
+    port=1212,
+    debug=False,
+    report_budget=0.5,
+    lenient_dates=False
+):
+    app = get_app(root, debug=debug, lenient_dates=lenient_dates)
 
-def bg_reports_task(loop, path):
-    executor = concurrent.futures.ProcessPoolExecutor()
-    future = loop.run_in_executor(executor, bg_run_reports, path)
+    loop = asyncio.get_event_loop()
 
-    def done_a_thing(x):
-        current_results.update(x.result())
-        loop.call_later(30, bg_reports_task, loop, path)
-    future.add_done_callback(done_a_thing)
+    scheduler = ReportScheduler(
+        loop,
+        bg_run_reports,
+        root,
+        current_results,
+        budget=report_budget,
+    )
+    app['scheduler'] = scheduler
 
+    exposure_log = app['configuration'].exposure_log
 
-def run(root, *, host='::', port=1212, debug=False):
-    app = get_app(root, debug=debug)
+    if exposure_log is not None:
+        from .exposures import ExposureLog, open_sink  # Lazy-load
 
-    loop = asyncio.get_event_loop()
+        logger.info("Logging exposures to %s", exposure_log)
+        app['exposures'] = ExposureLog(open_sink(exposure_log))
+        app['exposures'].start(loop)
 
     server = loop.create_server(
         app.make_handler(),
@@ -173,6 +305,21 @@ def run(root, *, host='::', port=1212, debug=False):
     )
     loop.run_until_complete(server)
 
-    loop.call_soon(bg_reports_task, loop, root)
+    scheduler.start()
+    loop.call_later(
+        CONFIGURATION_RELOAD_INTERVAL,
+        bg_reload_configuration,
+        loop,
+        app,
+    )
+
+    # Stop cleanly on SIGTERM too, as on a deploy
+    with contextlib.suppress(NotImplementedError):
+        loop.add_signal_handler(signal.SIGTERM, loop.stop)
 
-    loop.run_forever()
+    try:
+        loop.run_forever()
+    finally:
+        if app['exposures'] is not None:
+            logger.info("Writing out queued exposures")
+            loop.run_until_complete(app['exposures'].close())
@@ -4,8 +4,6 @@ import pathlib
 import argparse
 import contextlib
 
-from .app import run
-
 
 def argument_parser():
     parser = argparse.ArgumentParser(description="An A/B test server")
@@ -33,6 +31,19 @@ def argument_parser():
         help="host to which to bind",
     )
 
+    parser.add_argument(
+        "--report-budget",
+        type=float,
+        default=0.5,
+        help="fraction of time the report worker may spend running reports",
+    )
+
+    parser.add_argument(
+        "--lenient-dates",
+        action='store_true',
+        help="accept signup dates in any format dateutil understands",
+    )
+
     parser.add_argument(
         "-D",
         "--debug",
@@ -50,7 +61,144 @@ def argument_parser():
     return parser
 
 
+def compile_argument_parser():
+    parser = argparse.ArgumentParser(
+        prog="needle compile",
+        description="Validate configuration and snapshot it for fast loading",
+    )
+
+    parser.add_argument(
+        "dir",
+        type=pathlib.Path,
+        default=pathlib.Path.cwd(),
+        nargs='?',
+        help="main directory, defining tests and KPIs",
+    )
+
+    return parser
+
+
+def compile_main(args):
+    from .snapshot import compile_snapshot  # Lazy-load
+
+    options = compile_argument_parser().parse_args(args)
+
+    logging.basicConfig(level=logging.INFO)
+
+    compile_snapshot(options.dir)
+
+
+def report_argument_parser():
+    parser = argparse.ArgumentParser(
+        prog="needle report",
+        description="Run all reports once, in the foreground",
+    )
+
+    parser.add_argument(
+        "dir",
+        type=pathlib.Path,
+        default=pathlib.Path.cwd(),
+        nargs='?',
+        help="main directory, defining tests and KPIs",
+    )
+
+    parser.add_argument(
+        "--record-conclusions",
+        action='store_true',
+        help="freeze concluded sequential experiments, as the server does",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action='store_true',
+        help="print a per-stage time and memory breakdown, not the reports",
+    )
+
+    parser.add_argument(
+        "--no-memory",
+        action='store_true',
+        help="when profiling, do not trace memory (which slows reports)",
+    )
+
+    parser.add_argument(
+        "--flamegraph",
+        type=pathlib.Path,
+        help="when profiling, also write stages as collapsed stacks here",
+    )
+
+    parser.add_argument(
+        "--cprofile",
+        type=pathlib.Path,
+        help="write cProfile statistics here",
+    )
+
+    return parser
+
+
+def report_main(args):
+    import json  # Lazy-load
+    import cProfile  # Lazy-load
+    from .report import run_all_reports  # Lazy-load
+    from .profiling import Profiler  # Lazy-load
+    from .configuration import Configuration  # Lazy-load
+
+    options = report_argument_parser().parse_args(args)
+
+    logging.basicConfig(level=logging.INFO)
+
+    configuration = Configuration(options.dir)
+
+    # Build the models up front, so their imports are not profiled
+    configuration.kpis
+
+    with contextlib.ExitStack() as stack:
+        if options.profile:
+            profiler = stack.enter_context(Profiler(
+                memory=not options.no_memory,
+            ))
+
+        if options.cprofile is not None:
+            python_profile = cProfile.Profile()
+            stack.callback(python_profile.dump_stats, str(options.cprofile))
+            stack.callback(python_profile.disable)
+            python_profile.enable()
+
+        # Reports run by hand are for diagnosis and change nothing unless
+        # asked to, and profiling never does
+        reports = run_all_reports(
+            configuration,
+            record_conclusions=(
+                options.record_conclusions and
+                not options.profile
+            ),
+        )
+
+    if not options.profile:
+        json.dump(reports, sys.stdout, indent=2, default=float)
+        return
+
+    json.dump(profiler.root.as_dict(), sys.stdout, indent=2)
+
+    if options.flamegraph is not None:
+        with options.flamegraph.open('w', encoding='utf-8') as f:
+            f.writelines(
+                line + '\n'
+                for line in profiler.root.collapsed_stacks()
+            )
+
+
+COMMANDS = {
+    'compile': compile_main,
+    'report': report_main,
+}
+
+
 def main(args=sys.argv[1:]):
+    if args and args[0] in COMMANDS:
+        return COMMANDS[args[0]](args[1:])
+
+    from .app import run  # Lazy-load
+
     options = argument_parser().parse_args(args)
 
     verbose_output = options.debug or options.verbose
@@ -65,4 +213,6 @@ def main(args=sys.argv[1:]):
             host=options.bind,
             port=options.port,
             debug=options.debug,
+            report_budget=options.report_budget,
+            lenient_dates=options.lenient_dates,
         )
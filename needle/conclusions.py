@@ -0,0 +1,39 @@
+import json
+import logging
+import datetime
+
+logger = logging.getLogger(__name__)
+
+
+CONCLUSIONS_FILE = 'conclusions.json'
+
+
+def load_conclusions(root):
+    path = root / CONCLUSIONS_FILE
+
+    try:
+        with path.open('r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def record_conclusion(root, experiment_name, report):
+    logger.info("Recording conclusion of %r", experiment_name)
+
+    conclusions = load_conclusions(root)
+    conclusions[experiment_name] = {
+        **report,
+        'concluded_date': str(datetime.date.today()),
+    }
+
+    # Write then rename, so the serving process never reads half a file.
+    path = root / CONCLUSIONS_FILE
+    temporary_path = path.with_suffix('.tmp')
+
+    with temporary_path.open('w', encoding='utf-8') as f:
+        json.dump(conclusions, f, indent=2, sort_keys=True, default=float)
+
+    temporary_path.replace(path)
+
+    return conclusions[experiment_name]
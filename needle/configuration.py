@@ -1,53 +1,316 @@
-import yaml
+import copy
 import logging
+import datetime
 
 from .kpi import KPI
-from .models import MODEL_FAMILIES
-from .experiment import Experiment, Branch, UserClass
+from .snapshot import load_snapshot, source_stats, SNAPSHOT_FILE
+from .conclusions import load_conclusions, CONCLUSIONS_FILE
+from .experiment import (
+    Experiment,
+    Branch,
+    UserClass,
+    AnalysisMode,
+    split_by_site_area,
+)
 
 logger = logging.getLogger(__name__)
 
 
+SOURCE_FILES = (
+    'defaults.yaml',
+    'kpis.yaml',
+)
+
+EXPERIMENTS_FILE = 'experiments.yaml'
+
+EXPERIMENTS_DIRECTORY = 'experiments.d'
+
+# Experiment files are watched separately, and reloaded one by one
+WATCHED_FILES = SOURCE_FILES + (
+    CONCLUSIONS_FILE,
+    SNAPSHOT_FILE,
+)
+
+
+def is_experiment_file(filename):
+    return (
+        filename == EXPERIMENTS_FILE or
+        filename.startswith(EXPERIMENTS_DIRECTORY + '/')
+    )
+
+
 class Configuration:
-    def __init__(self, path):
+    def __init__(self, path, *, use_snapshot=True):
         self.path = path
         logger.info("Loading configuration from %s", self.path)
+
+        # Taken before reading anything, so no later change can be missed
+        self.stats = source_stats(path, WATCHED_FILES)
+
+        experiment_filenames = self._experiment_filenames()
+
+        if use_snapshot:
+            self.sources = load_snapshot(path, experiment_filenames)
+        else:
+            self.sources = None
+
+        if self.sources is None:
+            from .sources import load_sources  # Lazy-load
+
+            self.experiment_stats = source_stats(path, experiment_filenames)
+            self.sources = load_sources(
+                path,
+                SOURCE_FILES + tuple(experiment_filenames),
+            )
+        else:
+            logger.debug("Using configuration snapshot")
+
+            experiment_filenames = sorted(
+                filter(is_experiment_file, self.sources),
+                key=lambda x: (x != EXPERIMENTS_FILE, x),
+            )
+            self.experiment_stats = source_stats(path, experiment_filenames)
+
         logger.debug("Getting defaults")
         self.defaults = self._load_yaml('defaults.yaml')
-        self.site_areas = set()
 
         logger.debug("Loading experiments")
-        self._load_experiments()
+        self._load_experiments(experiment_filenames)
+
+        logger.debug("Loading conclusions")
+        self._load_conclusions()
+
+        logger.debug("Validating site areas")
+        self._splits = {}
+        self._validate_site_areas(self.site_areas)
 
         logger.debug("Loading KPIs")
         self._load_kpis()
 
+    def is_stale(self):
+        return source_stats(self.path, WATCHED_FILES) != self.stats
+
     def _load_kpis(self):
         source = self._load_yaml('kpis.yaml')
 
-        self.kpis = {}
+        self._kpis = None
+
+        self.connection_string = source['connection']
+
+        self.get_users_sql = source['get-users']
+
+        if 'exposure-log' in source:
+            self.exposure_log = self.path / source['exposure-log']
+        else:
+            self.exposure_log = None
+
+        self.report_from_exposures = source.get(
+            'report-from-exposures',
+            False,
+        )
+
+        if self.report_from_exposures and self.exposure_log is None:
+            logger.error("Reporting from exposures needs an exposure log")
+            raise ValueError("No exposure log to report from")
+
+    @property
+    def kpis(self):
+        # Built on first use, so that serving users never needs the models
+        # (nor numpy and scipy with them).
+        if self._kpis is None:
+            self._kpis = self._build_kpis()
+
+        return self._kpis
+
+    def _build_kpis(self):
+        from .models import MODEL_FAMILIES  # Lazy-load
+        from .models import PROB_IMPROVEMENT_METHODS  # Lazy-load
+
+        source = self._load_yaml('kpis.yaml')
+
+        kpis = {}
 
         for name, kpi in source['kpis'].items():
-            model = MODEL_FAMILIES[kpi['model']](kpi['prior'])
+            model = MODEL_FAMILIES[kpi['model']](self._load_prior(kpi))
+            prob_improvement = PROB_IMPROVEMENT_METHODS[
+                kpi.get('improvement', 'normal')
+            ]
 
-            self.kpis[name] = KPI(
+            kpis[name] = KPI(
                 name=kpi['name'],
                 description=kpi['description'],
                 model=model,
                 sql=kpi['sql'],
+                prob_improvement=prob_improvement,
             )
 
-        self.connection_string = source['connection']
+        return kpis
 
-        self.get_users_sql = source['get-users']
+    def _load_prior(self, kpi):
+        try:
+            filename = kpi['prior-file']
+        except KeyError:
+            return kpi['prior']
 
-    def _load_experiments(self):
-        source = self._load_yaml('experiments.yaml')
+        import numpy  # Lazy-load
 
-        self.experiments = []
+        # .npy holds a single array, such as bootstrap seed samples; .npz
+        # holds named arrays, which are used as a mapping.
+        prior = numpy.load(str(self.path / filename), allow_pickle=False)
+
+        if isinstance(prior, numpy.ndarray):
+            return prior
+
+        with prior:
+            return {
+                key: value.item() if value.ndim == 0 else value
+                for key, value in prior.items()
+            }
+
+    def _experiment_filenames(self):
+        filenames = []
+
+        if (self.path / EXPERIMENTS_FILE).exists():
+            filenames.append(EXPERIMENTS_FILE)
+
+        filenames.extend(sorted(
+            '%s/%s' % (EXPERIMENTS_DIRECTORY, x.name)
+            for x in (self.path / EXPERIMENTS_DIRECTORY).glob('*.yaml')
+        ))
+
+        return filenames
 
-        for experiment in source['experiments']:
+    def _load_experiments(self, filenames):
+        self.experiment_files = {
+            filename: self._load_experiment_file(filename)
+            for filename in filenames
+        }
+
+        self._index_experiments()
+
+    def _load_experiment_file(self, filename):
+        logger.debug("Loading experiments from %s", filename)
+        source = self._load_yaml(filename)
+
+        return [
             self._load_experiment(experiment)
+            for experiment in source['experiments']
+        ]
+
+    def _index_experiments(self):
+        self.experiments = []
+
+        for filename in sorted(
+            self.experiment_files,
+            key=lambda x: (x != EXPERIMENTS_FILE, x),
+        ):
+            self.experiments.extend(self.experiment_files[filename])
+
+        self.site_areas = {x.site_area for x in self.experiments}
+
+        names = set()
+
+        for experiment in self.experiments:
+            if experiment.name in names:
+                logger.error(
+                    "Experiment %s is defined more than once",
+                    experiment.name,
+                )
+                raise ValueError("Duplicate experiment %s" % experiment.name)
+
+            names.add(experiment.name)
+
+    def _validate_site_areas(self, site_areas):
+        for site_area in site_areas:
+            try:
+                self.site_area_splits(site_area)
+            except RuntimeError:
+                logger.error(
+                    "Site area %s has superunity coverage",
+                    site_area,
+                )
+                raise ValueError("Superunity coverage in %s" % site_area)
+
+    def site_area_splits(self, site_area):
+        # Assignment state for a site area: computed once a day, or again
+        # when the experiments in that site area change.
+        today = datetime.date.today()
+
+        try:
+            date, splits = self._splits[site_area]
+        except KeyError:
+            pass
+        else:
+            if date == today:
+                return splits
+
+        splits = split_by_site_area(site_area, self.experiments)
+        self._splits[site_area] = (today, splits)
+        return splits
+
+    def invalidate_site_areas(self, site_areas):
+        for site_area in site_areas:
+            self._splits.pop(site_area, None)
+
+    def changed_experiment_files(self):
+        filenames = self._experiment_filenames()
+
+        if not filenames:
+            # Deployed as a snapshot without its sources
+            return set()
+
+        stats = source_stats(self.path, filenames)
+
+        return {
+            filename
+            for filename in set(stats) | set(self.experiment_stats)
+            if stats.get(filename) != self.experiment_stats.get(filename)
+        }
+
+    def reload_experiment_files(self, filenames):
+        # Returns a new configuration with just these files reloaded. Only
+        # the site areas they touch lose their assignment state, and this
+        # configuration is left untouched for anyone still using it.
+        logger.info("Reloading %s", ", ".join(sorted(filenames)))
+
+        configuration = copy.copy(self)
+        configuration.sources = dict(self.sources)
+        configuration.experiment_files = dict(self.experiment_files)
+        configuration.experiment_stats = dict(self.experiment_stats)
+        configuration._splits = dict(self._splits)
+
+        stats = source_stats(self.path, filenames)
+
+        affected_site_areas = set()
+
+        for filename in filenames:
+            affected_site_areas.update(
+                x.site_area
+                for x in self.experiment_files.get(filename, ())
+            )
+
+            configuration.sources.pop(filename, None)
+            configuration.experiment_stats.pop(filename, None)
+
+            if filename not in stats:
+                configuration.experiment_files.pop(filename, None)
+                continue
+
+            experiments = configuration._load_experiment_file(filename)
+            configuration.experiment_files[filename] = experiments
+            configuration.experiment_stats[filename] = stats[filename]
+
+            affected_site_areas.update(x.site_area for x in experiments)
+
+        configuration._index_experiments()
+        configuration._load_conclusions()
+
+        configuration.invalidate_site_areas(affected_site_areas)
+        configuration._validate_site_areas(
+            affected_site_areas & configuration.site_areas,
+        )
+
+        return configuration
 
     def _load_experiment(self, experiment):
         experiment_name = experiment['name']
@@ -76,13 +339,24 @@ class Configuration:
             )
             raise ValueError("Superunity coverage in %s" % experiment_name)
 
-        site_area = experiment['site-area']
+        analysis = AnalysisMode(experiment.get('analysis', 'fixed'))
+        mixing_variance = experiment.get(
+            'mixing-variance',
+            experiment['minimum-change'] ** 2,
+        )
 
-        self.experiments.append(Experiment(
+        if analysis == AnalysisMode.SEQUENTIAL and mixing_variance <= 0:
+            logger.error(
+                "Experiment %s needs a positive mixing variance",
+                experiment_name,
+            )
+            raise ValueError("No mixing variance in %s" % experiment_name)
+
+        return Experiment(
             name=experiment_name,
             description=experiment.get('description', ""),
             confidence=experiment.get('confidence', 0.95),
-            site_area=site_area,
+            site_area=experiment['site-area'],
             user_class=UserClass(experiment.get('user-class', 'both')),
             start_date=experiment['start-date'],
             branches=branches,
@@ -92,16 +366,29 @@ class Configuration:
                 'secondary-kpis',
                 (),
             )),
-        ))
+            analysis=analysis,
+            mixing_variance=mixing_variance,
+        )
 
-        self.site_areas.add(site_area)
+    def _load_conclusions(self):
+        conclusions = load_conclusions(self.path)
 
-    def _load_yaml(self, filename):
-        path = self.path / filename
+        for experiment in self.experiments:
+            try:
+                experiment.conclusion = conclusions[experiment.name]
+            except KeyError:
+                continue
+
+            logger.info("Experiment %r is frozen", experiment.name)
 
+    def _load_yaml(self, filename):
         try:
-            with path.open('r', encoding='utf-8') as f:
-                return yaml.load(f)
-        except IOError:
-            logger.error("Could not load %s", filename)
-            raise
+            return self.sources[filename]
+        except KeyError:
+            pass
+
+        from .sources import load_source  # Lazy-load
+
+        source = load_source(self.path, filename)
+        self.sources[filename] = source
+        return source
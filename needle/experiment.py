@@ -11,6 +11,12 @@ class UserClass(enum.Enum):
     BOTH = 'both'
 
 
+@enum.unique
+class AnalysisMode(enum.Enum):
+    FIXED = 'fixed'
+    SEQUENTIAL = 'sequential'
+
+
 class Experiment:
     __slots__ = (
         'name',
@@ -23,6 +29,9 @@ class Experiment:
         'primary_kpi',
         'minimum_change',
         'secondary_kpis',
+        'analysis',
+        'mixing_variance',
+        'conclusion',
         'results',
     )
 
@@ -38,7 +47,9 @@ class Experiment:
         branches,
         primary_kpi,
         minimum_change,
-        secondary_kpis=()
+        secondary_kpis=(),
+        analysis=AnalysisMode.FIXED,
+        mixing_variance=None
     ):
         self.name = name
         self.description = description
@@ -50,6 +61,9 @@ class Experiment:
         self.primary_kpi = primary_kpi
         self.minimum_change = minimum_change
         self.secondary_kpis = secondary_kpis
+        self.analysis = analysis
+        self.mixing_variance = mixing_variance
+        self.conclusion = None
         self.results = None
 
     def __repr__(self):
@@ -65,6 +79,9 @@ class Experiment:
             primary_kpi=%r,
             minimum_change=%r,
             secondary_kpis=%r,
+            analysis=%r,
+            mixing_variance=%r,
+            conclusion=%r,
             results=%r,
         )''' % (
             self.name,
@@ -77,6 +94,9 @@ class Experiment:
             self.primary_kpi,
             self.minimum_change,
             self.secondary_kpis,
+            self.analysis,
+            self.mixing_variance,
+            self.conclusion,
             self.results,
         )).strip()
 
@@ -97,6 +117,30 @@ class Experiment:
     def is_concluded(self):
         return self.results is not None
 
+    @property
+    def is_frozen(self):
+        # Concluded by sequential analysis. Unlike a concluded experiment, a
+        # frozen one keeps its slice of the site area, so that the users of
+        # later experiments are not reassigned, but serves only the winning
+        # branch to all of it.
+        return self.conclusion is not None
+
+    @property
+    def winning_branch(self):
+        # Conclusions recorded without a winner, or naming a branch since
+        # removed, revert to control.
+        name = self.conclusion.get('winning_branch', 'control')
+
+        for branch in self.branches:
+            if branch.name == name:
+                return branch
+
+        return self.control_branch
+
+    @property
+    def control_branch(self):
+        return next(x for x in self.branches if x.name == 'control')
+
     @property
     def is_in_progress(self):
         return (
@@ -167,10 +211,7 @@ def user_valid_for_experiment(signup_date, experiment):
 
 def user_experiments(user_id, signup_date, configuration):
     for site_area in configuration.site_areas:
-        user_split = split_by_site_area(
-            site_area,
-            configuration.experiments,
-        )
+        user_split = configuration.site_area_splits(site_area)
 
         hash_base = ('%s/%s' % (
             user_id,
@@ -190,6 +231,9 @@ def user_experiments(user_id, signup_date, configuration):
                 # User is in this group, verify validity
 
                 if user_valid_for_experiment(signup_date, experiment):
+                    if experiment.is_frozen:
+                        branch = experiment.winning_branch
+
                     yield experiment, branch
 
                 break
@@ -0,0 +1,230 @@
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import collections
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+
+Exposure = collections.namedtuple('Exposure', (
+    'user_id',
+    'experiment',
+    'branch',
+    'timestamp',
+))
+
+
+class SQLiteSink:
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+
+    def _connect(self):
+        connection = sqlite3.connect(str(self.path))
+
+        # Write-ahead logging lets reports read while the server writes
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS exposures ('
+            'user_id INTEGER NOT NULL, '
+            'experiment TEXT NOT NULL, '
+            'branch TEXT NOT NULL, '
+            'timestamp REAL NOT NULL)'
+        )
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS exposures_by_experiment '
+            'ON exposures (experiment, user_id)'
+        )
+
+        return connection
+
+    def write(self, exposures):
+        if self.connection is None:
+            self.connection = self._connect()
+
+        with self.connection:
+            self.connection.executemany(
+                'INSERT INTO exposures VALUES (?, ?, ?, ?)',
+                exposures,
+            )
+
+    def exposed_users(self, experiment):
+        connection = self._connect()
+
+        try:
+            # SQLite takes the bare `branch` from the row with the MIN
+            yield from (
+                (user_id, branch)
+                for user_id, branch, timestamp in connection.execute(
+                    'SELECT user_id, branch, MIN(timestamp) '
+                    'FROM exposures WHERE experiment = ? GROUP BY user_id',
+                    (experiment,),
+                )
+            )
+        finally:
+            connection.close()
+
+
+class JSONLinesSink:
+    # Reports read the whole log once, on the first call to exposed_users,
+    # and share it between experiments: open a new sink to see exposures
+    # written since.
+
+    def __init__(self, path):
+        self.path = path
+        self.first_exposures = None
+
+    def write(self, exposures):
+        with self.path.open('a', encoding='utf-8') as f:
+            f.writelines(
+                json.dumps(exposure._asdict()) + '\n'
+                for exposure in exposures
+            )
+
+    def exposed_users(self, experiment):
+        if self.first_exposures is None:
+            self.first_exposures = self._read_first_exposures()
+
+        return (
+            (user_id, exposure.branch)
+            for user_id, exposure in self.first_exposures.get(
+                experiment,
+                {},
+            ).items()
+        )
+
+    def _read_first_exposures(self):
+        # Experiment name to user ID to the user's first exposure
+        first_exposures = collections.defaultdict(dict)
+
+        try:
+            with self.path.open('r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        # Still being written by the server
+                        break
+
+                    try:
+                        exposure = Exposure(**json.loads(line))
+                    except (ValueError, TypeError):
+                        logger.warning("Skipping malformed exposure %r", line)
+                        continue
+
+                    experiment_exposures = first_exposures[exposure.experiment]
+                    first_exposure = experiment_exposures.get(exposure.user_id)
+
+                    if (
+                        first_exposure is None or
+                        exposure.timestamp < first_exposure.timestamp
+                    ):
+                        experiment_exposures[exposure.user_id] = exposure
+        except FileNotFoundError:
+            pass
+
+        return first_exposures
+
+
+def open_sink(path):
+    if path.suffix in ('.sqlite', '.sqlite3', '.db'):
+        return SQLiteSink(path)
+
+    return JSONLinesSink(path)
+
+
+class ExposureLog:
+    # Exposures are queued by the request handler and written in batches by
+    # a background task, in a thread. When the queue is full exposures are
+    # dropped and counted, rather than slowing down requests.
+
+    def __init__(self, sink, *, max_queue=10000, batch_size=1000):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.counts = collections.Counter()
+        self.max_queue_depth = 0
+        self.task = None
+        self.closed = False
+
+    def start(self, loop):
+        self.task = asyncio.ensure_future(self._write_forever(loop), loop=loop)
+        return self.task
+
+    async def close(self):
+        # Writes out everything already queued, then stops the writer and
+        # its thread. Exposures recorded from now on are dropped.
+        self.closed = True
+
+        if self.task is not None:
+            await self.queue.put(None)
+            await self.task
+
+        self.executor.shutdown(wait=True)
+
+    def record(self, user_id, experiment, branch):
+        if self.closed:
+            self.counts['dropped'] += 1
+            return
+
+        exposure = Exposure(
+            user_id=user_id,
+            experiment=experiment,
+            branch=branch,
+            timestamp=time.time(),
+        )
+
+        try:
+            self.queue.put_nowait(exposure)
+        except asyncio.QueueFull:
+            self.counts['dropped'] += 1
+            return
+
+        self.counts['recorded'] += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    def metrics(self):
+        return {
+            'recorded': self.counts['recorded'],
+            'written': self.counts['written'],
+            'dropped': self.counts['dropped'],
+            'failed': self.counts['failed'],
+            'batches': self.counts['batches'],
+            'queue_depth': self.queue.qsize(),
+            'max_queue_depth': self.max_queue_depth,
+            'queue_capacity': self.queue.maxsize,
+        }
+
+    async def _write_forever(self, loop):
+        while True:
+            batch = [await self.queue.get()]
+
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            # Queued by close, after every exposure
+            stopping = batch[-1] is None
+
+            if stopping:
+                batch.pop()
+
+            if not batch:
+                return
+
+            try:
+                await loop.run_in_executor(
+                    self.executor,
+                    self.sink.write,
+                    batch,
+                )
+            except Exception:
+                logger.exception("Could not write %d exposures", len(batch))
+                self.counts['failed'] += len(batch)
+            else:
+                self.counts['written'] += len(batch)
+                self.counts['batches'] += 1
+
+            if stopping:
+                return
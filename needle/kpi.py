@@ -6,4 +6,5 @@ KPI = collections.namedtuple('KPI', (
     'description',
     'model',
     'sql',
+    'prob_improvement',
 ))
@@ -1,30 +1,54 @@
 import math
 import numpy
+import functools
+import logging
+import itertools
 import scipy.stats
 import collections
 
+from .sketch import QuantileSketch, bootstrap_medians
+from .profiling import stage
+
+logger = logging.getLogger(__name__)
+
 
 DistributionDescription = collections.namedtuple('DistributionDescription', (
     'mean',
     'std',
     'skewness',
     'percentiles',
+    'samples',  # Sorted draws from the distribution, not for reports
 ))
 
 
+NDRAWS = 20000
+
+PERCENTILE_POINTS = numpy.linspace(0, 1, 101)
+
+
+@functools.lru_cache(maxsize=1)
+def get_quantile_points():
+    # Evenly spaced rather than random, and shared by every distribution:
+    # this costs nothing per report, and repeated reports on unchanged data
+    # give identical answers.
+    return (numpy.arange(NDRAWS) + 0.5) / NDRAWS
+
+
 def describe_scipy_distribution(distribution):
     mean, var, skew = distribution.stats('mvs')
 
-    ppf = distribution.ppf
+    with stage('ppf'):
+        quantiles = distribution.ppf(numpy.concatenate((
+            PERCENTILE_POINTS,
+            get_quantile_points(),
+        )))
 
     return DistributionDescription(
         mean=float(mean),
         std=numpy.sqrt(var),
         skewness=float(skew),
-        percentiles=tuple(
-            float(ppf(x / 100))
-            for x in range(101)
-        ),
+        percentiles=tuple(float(x) for x in quantiles[:101]),
+        samples=quantiles[101:],
     )
 
 
@@ -33,11 +57,15 @@ def describe_empirical_distribution(data):
     std = numpy.std(data)
     skew = scipy.stats.skew(data)
 
+    with stage('percentiles'):
+        percentiles = tuple(numpy.percentile(data, range(101)))
+
     return DistributionDescription(
         mean=mean,
         std=std,
         skewness=skew,
-        percentiles=tuple(numpy.percentile(data, range(101))),
+        percentiles=percentiles,
+        samples=numpy.sort(data),
     )
 
 
@@ -56,13 +84,16 @@ class Model(object):
         if len(user_ids) == 0:
             return numpy.array([])
 
-        return numpy.array([
+        samples = [
             x
             for (x,) in run_query(
                 sql,
                 users=user_ids,
             )
-        ])
+        ]
+
+        with stage('numpy.array'):
+            return numpy.array(samples)
 
     def analyse_samples(self, samples):
         raise NotImplementedError("Must implement `analyse_samples`")
@@ -93,14 +124,15 @@ class BootstrapModel(Model):
     def analyse_samples(self, samples):
         sample_db = numpy.append(samples, self.seed_samples)
 
-        bootstraps = numpy.array([
-            self.statistic(numpy.random.choice(
-                sample_db,
-                len(sample_db),
-                replace=True,
-            ))
-            for x in range(self.NBOOTSTRAPS)
-        ])
+        with stage('bootstrap'):
+            bootstraps = numpy.array([
+                self.statistic(numpy.random.choice(
+                    sample_db,
+                    len(sample_db),
+                    replace=True,
+                ))
+                for x in range(self.NBOOTSTRAPS)
+            ])
 
         return describe_empirical_distribution(bootstraps)
 
@@ -122,10 +154,261 @@ class MeanBootstrapModel(BootstrapModel):
         return numpy.mean(data.astype(float))
 
 
+class MedianSketchModel(MedianBootstrapModel):
+    # Approximate median: rows are streamed from the query into a quantile
+    # sketch, and the bootstrap resamples the sketch's histogram instead of
+    # the full data. The median is within `relative-error` of the exact one.
+    name = "Median (sketch)"
+
+    CHUNK_SIZE = 65536
+
+    DEFAULT_RELATIVE_ERROR = 0.01
+
+    def __init__(self, prior):
+        # Seed samples as for median_bootstrap, or a mapping with them as
+        # `samples` and optionally a `relative-error`.
+        if isinstance(prior, dict):
+            samples = prior['samples']
+            relative_error = prior.get(
+                'relative-error',
+                self.DEFAULT_RELATIVE_ERROR,
+            )
+        else:
+            samples = prior
+            relative_error = self.DEFAULT_RELATIVE_ERROR
+
+        self.seed_sketch = QuantileSketch(relative_error)
+        self.seed_sketch.add(samples)
+
+    def evaluate(self, user_ids, sql, run_query):
+        sketch, sample_size = self.get_sketch(user_ids, sql, run_query)
+
+        return self.analyse_sketch(sketch), sample_size
+
+    def get_sketch(self, user_ids, sql, run_query):
+        sketch = self.seed_sketch.copy()
+        sample_size = 0
+
+        if len(user_ids) == 0:
+            return sketch, sample_size
+
+        rows = iter(run_query(sql, users=user_ids))
+
+        while True:
+            chunk = numpy.fromiter(
+                (float(x) for (x,) in itertools.islice(rows, self.CHUNK_SIZE)),
+                dtype=float,
+            )
+
+            if len(chunk) == 0:
+                break
+
+            with stage('sketch'):
+                sketch.add(chunk)
+
+            sample_size += len(chunk)
+
+        return sketch, sample_size
+
+    def analyse_samples(self, samples):
+        sketch = self.seed_sketch.copy()
+        sketch.add(samples)
+
+        return self.analyse_sketch(sketch)
+
+    def analyse_sketch(self, sketch):
+        with stage('bootstrap'):
+            bootstraps = bootstrap_medians(sketch, self.NBOOTSTRAPS)
+
+        return describe_empirical_distribution(bootstraps)
+
+
+class NormalModel(Model):
+    # Conjugate Normal-Inverse-Gamma model, fitted from the count, sum and
+    # sum of squares of the samples. The database computes these by wrapping
+    # the KPI's SQL, so individual samples never leave it.
+    name = "Mean (normal)"
+
+    AGGREGATE_SQL = (
+        "SELECT COUNT(value), SUM(value), SUM(value * value) "
+        "FROM ({sql}) AS samples (value)"
+    )
+
+    def __init__(self, prior):
+        # The prior is worth `weight` pseudo-observations with the given
+        # mean and variance.
+        self.prior_mean = prior['mean']
+        self.prior_variance = prior['variance']
+        self.prior_weight = prior['weight']
+
+        if self.prior_weight <= 2:
+            # Otherwise the posterior with no data has infinite variance
+            raise ValueError("Prior weight must be greater than 2")
+
+    def evaluate(self, user_ids, sql, run_query):
+        count, total, total_squares = self.get_statistics(
+            user_ids,
+            sql,
+            run_query,
+        )
+
+        return self.analyse_statistics(count, total, total_squares), count
+
+    def get_statistics(self, user_ids, sql, run_query):
+        if len(user_ids) == 0:
+            return 0, 0.0, 0.0
+
+        ((count, total, total_squares),) = run_query(
+            self.AGGREGATE_SQL.format(sql=sql),
+            users=user_ids,
+        )
+
+        # SUM is NULL over no rows
+        return count, float(total or 0), float(total_squares or 0)
+
+    def analyse_samples(self, samples):
+        samples = self.transform(samples.astype(float))
+
+        return self.analyse_statistics(
+            len(samples),
+            numpy.sum(samples),
+            numpy.sum(samples ** 2),
+        )
+
+    def transform(self, samples):
+        return samples
+
+    def analyse_statistics(self, count, total, total_squares):
+        return describe_scipy_distribution(self.posterior_of_mean(
+            count,
+            total,
+            total_squares,
+        ))
+
+    def posterior_of_mean(self, count, total, total_squares):
+        mean, weight, alpha, beta = self.posterior_parameters(
+            count,
+            total,
+            total_squares,
+        )
+
+        return scipy.stats.t(
+            df=2 * alpha,
+            loc=mean,
+            scale=math.sqrt(beta / (alpha * weight)),
+        )
+
+    def posterior_parameters(self, count, total, total_squares):
+        # The variance is InvGamma(alpha, beta), and the mean given the
+        # variance is Normal(mean, variance / weight).
+        prior_alpha = self.prior_weight / 2
+        prior_beta = self.prior_weight * self.prior_variance / 2
+
+        weight = self.prior_weight + count
+        alpha = prior_alpha + count / 2
+
+        if count:
+            sample_mean = total / count
+            square_deviations = max(
+                total_squares - count * sample_mean ** 2,
+                0,
+            )
+        else:
+            sample_mean = 0
+            square_deviations = 0
+
+        mean = (
+            self.prior_weight * self.prior_mean + count * sample_mean
+        ) / weight
+
+        beta = prior_beta + square_deviations / 2 + (
+            self.prior_weight * count *
+            (sample_mean - self.prior_mean) ** 2 /
+            (2 * weight)
+        )
+
+        return mean, weight, alpha, beta
+
+
+class LogNormalModel(NormalModel):
+    # As NormalModel on the logarithms of the samples, describing the mean
+    # exp(mu + sigma^2 / 2) of the log-normal distribution by sampling from
+    # the posterior of mu and sigma^2. The prior is on the log scale. Only
+    # positive samples can be fitted: others are excluded, and logged.
+    name = "Mean (log-normal)"
+
+    NSAMPLES = 10000
+
+    AGGREGATE_SQL = (
+        "SELECT COUNT(value), COUNT(CASE WHEN value > 0 THEN 1 END), "
+        "SUM(CASE WHEN value > 0 THEN LN(value) END), "
+        "SUM(CASE WHEN value > 0 THEN LN(value) * LN(value) END) "
+        "FROM ({sql}) AS samples (value)"
+    )
+
+    def evaluate(self, user_ids, sql, run_query):
+        if len(user_ids) == 0:
+            return self.analyse_statistics(0, 0.0, 0.0), 0
+
+        ((rows, count, total, total_squares),) = run_query(
+            self.AGGREGATE_SQL.format(sql=sql),
+            users=user_ids,
+        )
+
+        self.log_excluded(rows, count)
+
+        # The sample size is of every row, fitted or not
+        return self.analyse_statistics(
+            count,
+            float(total or 0),
+            float(total_squares or 0),
+        ), rows
+
+    def transform(self, samples):
+        positive_samples = samples[samples > 0]
+        self.log_excluded(len(samples), len(positive_samples))
+
+        return numpy.log(positive_samples)
+
+    def log_excluded(self, rows, count):
+        if rows > count:
+            logger.warning(
+                "Excluded %d non-positive samples of %d from the "
+                "log-normal model",
+                rows - count,
+                rows,
+            )
+
+    def analyse_statistics(self, count, total, total_squares):
+        mean, weight, alpha, beta = self.posterior_parameters(
+            count,
+            total,
+            total_squares,
+        )
+
+        with stage('posterior samples'):
+            variances = scipy.stats.invgamma.rvs(
+                alpha,
+                scale=beta,
+                size=self.NSAMPLES,
+            )
+            log_medians = numpy.random.normal(
+                mean,
+                numpy.sqrt(variances / weight),
+            )
+
+        return describe_empirical_distribution(
+            numpy.exp(log_medians + variances / 2),
+        )
+
+
 MODEL_FAMILIES = {
     'bernoulli': BernoulliModel,
     'median_bootstrap': MedianBootstrapModel,
+    'median_sketch': MedianSketchModel,
     'mean_bootstrap': MeanBootstrapModel,
+    'mean_normal': NormalModel,
+    'lognormal': LogNormalModel,
 }
 
 
@@ -134,6 +417,7 @@ BranchEvaluation = collections.namedtuple('BranchEvaluation', (
     'sample_size',
     'p_positive',
     'p_negative',
+    'p_value',
 ))
 
 
@@ -164,6 +448,77 @@ def calculate_prob_improvement(
         return prob_test_above, prob_test_below
 
 
+def prob_difference_above(reference_samples, test_samples, threshold):
+    # P(test - reference > threshold) over every pair of draws: for each
+    # test draw, count the (sorted) reference draws more than `threshold`
+    # below it.
+    pairs = numpy.searchsorted(
+        reference_samples,
+        test_samples - threshold,
+        side='left',
+    ).sum()
+
+    return pairs / (len(reference_samples) * len(test_samples))
+
+
+def calculate_sampled_prob_improvement(
+    reference,
+    test,
+    minimum_effect_size=0,
+):
+    # From draws of the posteriors themselves, so skewed posteriors (Beta
+    # at low rates, bootstrapped medians) are not forced to be normal.
+    minimum_effect_negative_tail = minimum_effect_size < 0
+    minimum_effect_size = abs(minimum_effect_size)
+
+    prob_test_above = prob_difference_above(
+        reference.samples,
+        test.samples,
+        minimum_effect_size,
+    )
+    prob_test_below = prob_difference_above(
+        test.samples,
+        reference.samples,
+        minimum_effect_size,
+    )
+
+    if minimum_effect_negative_tail:
+        return prob_test_below, prob_test_above
+    else:
+        return prob_test_above, prob_test_below
+
+
+PROB_IMPROVEMENT_METHODS = {
+    'normal': calculate_prob_improvement,
+    'sampled': calculate_sampled_prob_improvement,
+}
+
+
+def calculate_always_valid_p(
+    reference,
+    test,
+    mixing_variance,
+    minimum_effect_size=0,
+):
+    # mSPRT with a normal mixture over the effect size, using the normal
+    # approximation to the posteriors as the sampling distribution of the
+    # difference. The resulting p-value may be checked after every report
+    # without inflating the false positive rate.
+    effect = test.mean - reference.mean - minimum_effect_size
+    variance = reference.std ** 2 + test.std ** 2
+
+    if variance <= 0:
+        return 1.0
+
+    log_likelihood_ratio = (
+        0.5 * math.log(variance / (variance + mixing_variance)) +
+        (mixing_variance * effect ** 2) /
+        (2 * variance * (variance + mixing_variance))
+    )
+
+    return min(1.0, math.exp(-log_likelihood_ratio))
+
+
 def evaluate_model(
     branches,
     model,
@@ -171,23 +526,28 @@ def evaluate_model(
     run_query,
     minimum_effect_size=0,  # Positive for > tail, negative for < tail
     control_branch='control',
+    mixing_variance=None,  # Set to also compute an always-valid p-value
+    prob_improvement=calculate_prob_improvement,
 ):
     # Branches are a dict of branch names to user ID tuples.
     # 2 stage: first calculate all branches, then annotate with p_positive and
     # p_negative.
 
     # Stage 1: Model evaluation
-    def describe_branch(users):
-        posterior, samples = model.evaluate(tuple(users), sql, run_query)
+    def describe_branch(branch_id, users):
+        with stage('branch:%s' % branch_id):
+            posterior, samples = model.evaluate(tuple(users), sql, run_query)
+
         return BranchEvaluation(
             posterior=posterior,
             sample_size=samples,
             p_positive=None,
             p_negative=None,
+            p_value=None,
         )
 
     results = {
-        branch_id: describe_branch(branch_users)
+        branch_id: describe_branch(branch_id, branch_users)
         for branch_id, branch_users in branches.items()
     }
 
@@ -200,15 +560,27 @@ def evaluate_model(
 
         branch_posterior = results[branch].posterior
 
-        p_positive, p_negative = calculate_prob_improvement(
-            control_posterior,
-            branch_posterior,
-            minimum_effect_size,
-        )
+        with stage('prob_improvement'):
+            p_positive, p_negative = prob_improvement(
+                control_posterior,
+                branch_posterior,
+                minimum_effect_size,
+            )
+
+        if mixing_variance is not None:
+            p_value = calculate_always_valid_p(
+                control_posterior,
+                branch_posterior,
+                mixing_variance,
+                minimum_effect_size,
+            )
+        else:
+            p_value = None
 
         results[branch] = results[branch]._replace(
             p_positive=p_positive,
             p_negative=p_negative,
+            p_value=p_value,
         )
 
     return results
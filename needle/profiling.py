@@ -0,0 +1,179 @@
+import time
+import itertools
+import contextlib
+import tracemalloc
+
+
+# The active Profiler, if any. Reports run in a single thread, so one is
+# enough, and instrumented code needs no profiler passed down to it.
+current_profiler = None
+
+
+class Stage:
+    __slots__ = (
+        'name',
+        'calls',
+        'seconds',
+        'allocated',
+        'peak',
+        'children',
+    )
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.allocated = 0
+        self.peak = 0
+        self.children = {}
+
+    def child(self, name):
+        try:
+            return self.children[name]
+        except KeyError:
+            child = self.children[name] = Stage(name)
+            return child
+
+    @property
+    def self_seconds(self):
+        return self.seconds - sum(
+            x.seconds
+            for x in self.children.values()
+        )
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'seconds': self.seconds,
+            'self_seconds': self.self_seconds,
+            'allocated_bytes': self.allocated,
+            'peak_bytes': self.peak,
+            'children': [x.as_dict() for x in self.children.values()],
+        }
+
+    def collapsed_stacks(self, prefix=()):
+        # The "folded" format read by flamegraph.pl and speedscope, in
+        # microseconds of self time.
+        stack = prefix + (self.name.replace(';', ','),)
+
+        yield '%s %d' % (';'.join(stack), round(self.self_seconds * 1e6))
+
+        for child in self.children.values():
+            yield from child.collapsed_stacks(stack)
+
+
+class Profiler:
+    # Times nested stages, and with `memory` also tracks their allocations
+    # with tracemalloc, which slows everything down noticeably.
+
+    def __init__(self, *, memory=True):
+        self.memory = memory
+        self.root = Stage('run_all_reports')
+        self.frames = []
+
+    def __enter__(self):
+        global current_profiler
+        current_profiler = self
+
+        if self.memory:
+            tracemalloc.start()
+
+        self._enter(self.root)
+        return self
+
+    def __exit__(self, *exc_info):
+        global current_profiler
+
+        self._exit()
+
+        if self.memory:
+            tracemalloc.stop()
+
+        current_profiler = None
+
+    def _memory(self):
+        if not self.memory:
+            return 0, 0
+
+        return tracemalloc.get_traced_memory()
+
+    def _reset_peak(self):
+        # Only available from Python 3.9; without it peaks are cumulative
+        if self.memory and hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    def _enter(self, stage):
+        current_memory, peak_memory = self._memory()
+
+        # Credit the peak so far to the enclosing stage before resetting it
+        if self.frames:
+            parent_frame = self.frames[-1]
+            parent_frame[3] = max(parent_frame[3], peak_memory)
+
+        self._reset_peak()
+
+        # Stage, start time, start memory, highest memory seen
+        self.frames.append([
+            stage,
+            time.perf_counter(),
+            current_memory,
+            current_memory,
+        ])
+
+    def _exit(self):
+        stage, start_time, start_memory, highest_memory = self.frames.pop()
+        current_memory, peak_memory = self._memory()
+        highest_memory = max(highest_memory, peak_memory)
+
+        stage.calls += 1
+        stage.seconds += time.perf_counter() - start_time
+        stage.allocated += current_memory - start_memory
+        stage.peak = max(stage.peak, highest_memory - start_memory)
+
+        if self.frames:
+            parent_frame = self.frames[-1]
+            parent_frame[3] = max(parent_frame[3], highest_memory)
+
+        self._reset_peak()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stage = self.frames[-1][0].child(name)
+        self._enter(stage)
+
+        try:
+            yield stage
+        finally:
+            self._exit()
+
+
+@contextlib.contextmanager
+def stage(name):
+    if current_profiler is None:
+        yield None
+        return
+
+    with current_profiler.stage(name) as profiled_stage:
+        yield profiled_stage
+
+
+def iterate(name, iterable, chunk_size=1000):
+    # Attribute the time spent producing items, such as fetching rows from
+    # the database, to a stage of its own. They are produced in chunks: a
+    # stage for each item would cost more than most items do.
+    if current_profiler is None:
+        return iterable
+
+    return _iterate(name, iter(iterable), chunk_size)
+
+
+def _iterate(name, iterator, chunk_size):
+    while True:
+        with stage(name):
+            chunk = list(itertools.islice(iterator, chunk_size))
+
+        if not chunk:
+            return
+
+        yield from chunk
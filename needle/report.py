@@ -1,37 +1,92 @@
+import time
 import logging
 import datetime
 import sqlalchemy
 
 from .models import evaluate_model
-from .experiment import user_experiments
+from .profiling import stage, iterate
+from .conclusions import record_conclusion
+from .experiment import user_experiments, AnalysisMode
 
 logger = logging.getLogger(__name__)
 
 
-def run_all_reports(configuration):
+def run_all_reports(configuration, skip=(), record_conclusions=True):
     logger.info("Running all reports")
     now = datetime.date.today()
 
     reports = {}
 
+    if configuration.report_from_exposures:
+        from .exposures import open_sink  # Lazy-load
+
+        # Shared by every experiment, so the log is read once per cycle
+        exposures = open_sink(configuration.exposure_log)
+    else:
+        exposures = None
+
     for experiment in configuration.experiments:
-        if experiment.start_date > now or experiment.results is not None:
+        if experiment.is_frozen:
+            # Reuse the recorded conclusion without touching the DB.
+            reports[experiment.name] = experiment.conclusion
+            continue
+
+        if (
+            experiment.start_date > now or
+            experiment.results is not None or
+            experiment.name in skip
+        ):
             continue
 
-        reports[experiment.name] = evaluate_report(experiment, configuration)
+        with stage('experiment:%s' % experiment.name):
+            report = evaluate_report(
+                experiment,
+                configuration,
+                exposures=exposures,
+            )
+
+        if (
+            record_conclusions and
+            experiment.analysis == AnalysisMode.SEQUENTIAL and
+            report['recommendation'] == "conclude"
+        ):
+            report = record_conclusion(
+                configuration.path,
+                experiment.name,
+                {
+                    **report,
+                    'winning_branch': get_winning_branch(
+                        report['primary'],
+                        experiment,
+                    ),
+                },
+            )
+            experiment.conclusion = report
+
+        reports[experiment.name] = report
 
     logger.info("Finished running reports")
 
     return reports
 
 
-def get_recommendation(kpi_result):
+def get_recommendation(kpi_result, experiment):
     non_control_branches = [
         branch
         for branch_name, branch in kpi_result['data'].items()
         if branch_name != 'control'
     ]
 
+    if experiment.analysis == AnalysisMode.SEQUENTIAL:
+        # Always-valid p-values: safe to stop at the first report in which
+        # any branch differs, however often we have looked before.
+        significance = 1 - experiment.confidence
+
+        if any(x['p_value'] < significance for x in non_control_branches):
+            return "conclude"
+
+        return "continue"
+
     if (
         all(x['p_negative'] < 0.05 for x in non_control_branches) or
         any(x['p_positive'] > 0.95 for x in non_control_branches)
@@ -41,8 +96,67 @@ def get_recommendation(kpi_result):
     return "continue"
 
 
-def evaluate_report(experiment, configuration):
+def get_winning_branch(kpi_result, experiment):
+    # The branch a concluded sequential experiment serves from then on: the
+    # likeliest improvement of those branches which differ from control, or
+    # control if none of them is an improvement.
+    significance = 1 - experiment.confidence
+
+    improvements = [
+        (branch['p_positive'], branch_name)
+        for branch_name, branch in kpi_result['data'].items()
+        if branch_name != 'control' and
+        branch['p_value'] < significance and
+        branch['p_positive'] > branch['p_negative']
+    ]
+
+    if not improvements:
+        return 'control'
+
+    return max(improvements)[1]
+
+
+def builtin(value):
+    # numpy scalars to their Python equivalents, so that unpickling reports
+    # from the worker process does not import numpy into the server.
+    # numpy.float64 subclasses float, hence the exact type check.
+    if value is None or type(value) in (bool, int, float):
+        return value
+
+    return value.item()
+
+
+def kpi_result(kpi, model_data, cost):
+    return {
+        'kpi': kpi.name,
+        'description': kpi.description,
+        'model': kpi.model.name,
+        'cost': cost,
+        'data': {
+            branch: {
+                'p_positive': builtin(models.p_positive),
+                'p_negative': builtin(models.p_negative),
+                'p_value': builtin(models.p_value),
+                'sample_size': builtin(models.sample_size),
+                'posterior': {
+                    'mean': builtin(models.posterior.mean),
+                    'std': builtin(models.posterior.std),
+                    'skewness': builtin(models.posterior.skewness),
+                    'percentiles': tuple(
+                        builtin(x)
+                        for x in models.posterior.percentiles
+                    ),
+                },
+            }
+            for branch, models in model_data.items()
+        },
+    }
+
+
+def evaluate_report(experiment, configuration, *, exposures=None):
     logging.info("Reporting on %s", experiment.name)
+    report_start = time.perf_counter()
+
     logger.debug("Connecting to DB")
     db_connection = sqlalchemy.create_engine(
         configuration.connection_string,
@@ -53,60 +167,99 @@ def evaluate_report(experiment, configuration):
         for x in experiment.branches
     }
 
+    # Rows are streamed rather than fetched up front, so consumers which
+    # reduce them as they go need not hold the whole result in memory.
+    db_streaming = db_connection.execution_options(stream_results=True)
+
     def run_query(x, *args, **kwargs):
-        return list(db_connection.execute(x, *args, **kwargs))
-
-    logger.debug("Enumerating users")
-    for user_id, signup_date in run_query(configuration.get_users_sql):
-        for user_experiment, experiment_branch in user_experiments(
-            user_id,
-            signup_date,
-            configuration,
-        ):
-            if user_experiment == experiment:
-                users_by_branch[experiment_branch.name].add(user_id)
+        # Executing and fetching are both counted as 'sql'
+        with stage('sql'):
+            result = db_streaming.execute(x, *args, **kwargs)
+
+        return iterate('sql', result)
+
+    if configuration.report_from_exposures:
+        if exposures is None:
+            from .exposures import open_sink  # Lazy-load
+            exposures = open_sink(configuration.exposure_log)
+
+        logger.debug("Reading exposed users")
+
+        with stage('exposures'):
+            for user_id, branch_name in exposures.exposed_users(
+                experiment.name,
+            ):
+                # Exposures to since-removed branches are of no use
+                if branch_name in users_by_branch:
+                    users_by_branch[branch_name].add(user_id)
+    else:
+        logger.debug("Enumerating users")
+        with stage('get-users'):
+            rows = run_query(configuration.get_users_sql)
+
+            # Fetching rows is timed under 'sql', bucketing users here
+            with stage('user_experiments'):
+                for user_id, signup_date in rows:
+                    assignments = user_experiments(
+                        user_id,
+                        signup_date,
+                        configuration,
+                    )
+
+                    for user_experiment, experiment_branch in assignments:
+                        if user_experiment == experiment:
+                            branch_name = experiment_branch.name
+                            users_by_branch[branch_name].add(user_id)
 
     for branch in experiment.branches:
         logger.debug("%s: %d", branch.name, len(users_by_branch[branch.name]))
 
-    def run_kpi(kpi_name, minimum_effect_size=0):
+    users_cost = time.perf_counter() - report_start
+
+    def run_kpi(kpi_name, minimum_effect_size=0, mixing_variance=None):
         kpi = configuration.kpis[kpi_name]
 
         logger.debug("Running KPI %s", kpi.name)
+        kpi_start = time.perf_counter()
+
+        with stage('kpi:%s' % kpi_name):
+            model_data = evaluate_model(
+                users_by_branch,
+                kpi.model,
+                kpi.sql,
+                run_query,
+                minimum_effect_size=minimum_effect_size,
+                mixing_variance=mixing_variance,
+                prob_improvement=kpi.prob_improvement,
+            )
 
-        model_data = evaluate_model(
-            users_by_branch,
-            kpi.model,
-            kpi.sql,
-            run_query,
-            minimum_effect_size=minimum_effect_size,
+        return kpi_result(kpi, model_data, time.perf_counter() - kpi_start)
+
+    if experiment.analysis == AnalysisMode.SEQUENTIAL:
+        # The mixing variance is in units of the primary KPI only.
+        primary_kpi_result = run_kpi(
+            experiment.primary_kpi,
+            mixing_variance=experiment.mixing_variance,
         )
+    else:
+        primary_kpi_result = run_kpi(experiment.primary_kpi)
 
-        return {
-            'kpi': kpi.name,
-            'description': kpi.description,
-            'model': kpi.model.name,
-            'data': {
-                branch: {
-                    'p_positive': models.p_positive,
-                    'p_negative': models.p_negative,
-                    'sample_size': models.sample_size,
-                    'posterior': models.posterior._asdict(),
-                }
-                for branch, models in model_data.items()
-            },
-        }
-
-    primary_kpi_result = run_kpi(experiment.primary_kpi)
+    secondary_kpi_results = [
+        run_kpi(x)
+        for x in experiment.secondary_kpis
+    ]
 
     return {
         'experiment': experiment.name,
         'description': experiment.description,
         'start_date': str(experiment.start_date),
         'primary': primary_kpi_result,
-        'recommendation': get_recommendation(primary_kpi_result),
-        'secondaries': [
-            run_kpi(x)
-            for x in experiment.secondary_kpis
-        ],
+        'analysis': experiment.analysis.value,
+        'recommendation': get_recommendation(
+            primary_kpi_result,
+            experiment,
+        ),
+        'secondaries': secondary_kpi_results,
+        'users_cost': users_cost,
+        'cost': time.perf_counter() - report_start,
     }
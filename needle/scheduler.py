@@ -0,0 +1,326 @@
+import logging
+import functools
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+
+def report_kpis(report):
+    yield report['primary']
+    yield from report['secondaries']
+
+
+def posterior_drift(old_report, new_report):
+    # Largest shift in any posterior mean between two reports, measured in
+    # units of the new posterior's standard deviation.
+    old_kpis = {x['kpi']: x for x in report_kpis(old_report)}
+
+    drift = {}
+
+    for kpi in report_kpis(new_report):
+        try:
+            old_kpi = old_kpis[kpi['kpi']]
+        except KeyError:
+            continue
+
+        kpi_drift = 0
+
+        for branch, data in kpi['data'].items():
+            try:
+                old_posterior = old_kpi['data'][branch]['posterior']
+            except KeyError:
+                continue
+
+            posterior = data['posterior']
+
+            if not posterior['std']:
+                continue
+
+            kpi_drift = max(kpi_drift, abs(
+                posterior['mean'] - old_posterior['mean'],
+            ) / posterior['std'])
+
+        drift[kpi['kpi']] = kpi_drift
+
+    return drift
+
+
+class ExperimentSchedule:
+    __slots__ = (
+        'interval',
+        'cost',
+        'kpi_costs',
+        'drift',
+        'last_run',
+        'next_run',
+        'frozen',
+    )
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.cost = 0
+        self.kpi_costs = {}
+        self.drift = {}
+        self.last_run = None
+        self.next_run = 0
+        self.frozen = False
+
+    def as_dict(self):
+        return {
+            'interval': self.interval,
+            'cost': self.cost,
+            'kpi_costs': self.kpi_costs,
+            'drift': self.drift,
+            'frozen': self.frozen,
+        }
+
+
+class ReportScheduler:
+    # Refreshes experiment reports in a worker process, as often as each
+    # needs. Experiments whose posteriors barely move between reports are
+    # refreshed less often, and all intervals are stretched together if the
+    # total cost would exceed `budget`: the fraction of wall-clock time the
+    # worker may spend running reports.
+
+    def __init__(
+        self,
+        loop,
+        run_reports,
+        path,
+        results,
+        *,
+        budget=0.5,
+        min_interval=30,
+        max_interval=3600,
+        target_drift=0.1
+    ):
+        self.loop = loop
+        self.run_reports = run_reports
+        self.path = path
+        self.results = results
+
+        self.budget = budget
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_drift = target_drift
+
+        self.schedules = {}
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+        self.running = False
+        self.timer = None
+        self.failures = 0
+        self.pending_refreshes = set()
+
+    def start(self):
+        self._wake(0)
+
+    def refresh(self, experiment=None):
+        if self.running:
+            # The cycle under way started before this request, and would
+            # reschedule its experiments as if they were fresh: apply the
+            # refresh once it has finished.
+            self.pending_refreshes.add(experiment)
+            return
+
+        self._mark_due(experiment)
+        self._wake(0)
+
+    def _mark_due(self, experiment):
+        if experiment is None:
+            schedules = self.schedules.values()
+        elif experiment in self.schedules:
+            schedules = (self.schedules[experiment],)
+        else:
+            # Not reported on yet, so it is already due
+            schedules = ()
+
+        for schedule in schedules:
+            schedule.next_run = 0
+
+    def _wake(self, delay):
+        if self.timer is not None:
+            self.timer.cancel()
+
+        self.timer = self.loop.call_later(delay, self._run)
+
+    def _run(self):
+        self.timer = None
+
+        now = self.loop.time()
+
+        skip = {
+            name
+            for name, schedule in self.schedules.items()
+            if schedule.frozen or schedule.next_run > now
+        }
+
+        logger.debug("Starting report cycle, skipping %d", len(skip))
+
+        self.running = True
+        future = self.loop.run_in_executor(
+            self.executor,
+            functools.partial(self.run_reports, self.path, skip=skip),
+        )
+        future.add_done_callback(functools.partial(self._finished, skip))
+
+    def _finished(self, skip, future):
+        self.running = False
+
+        now = self.loop.time()
+
+        try:
+            reports = future.result()
+        except Exception:
+            # Every experiment is due again once the back-off is over
+            self.pending_refreshes.clear()
+            self._failed(now)
+            return
+
+        self.failures = 0
+
+        unfrozen = self._forget(skip, reports)
+
+        for name, report in reports.items():
+            self._update(name, report, now)
+
+        self.results.update(reports)
+
+        self._rebalance(updated=reports.keys())
+
+        for experiment in self.pending_refreshes:
+            self._mark_due(experiment)
+
+        self.pending_refreshes.clear()
+
+        pending = [
+            schedule.next_run
+            for schedule in self.schedules.values()
+            if not schedule.frozen
+        ]
+
+        if unfrozen:
+            # Skipped by this cycle while still frozen, and due now
+            self._wake(0)
+        elif pending:
+            self._wake(max(0, min(pending) - now))
+        else:
+            self._wake(self.min_interval)
+
+    def _forget(self, skip, reports):
+        # Drops the schedules of experiments which were due but not reported
+        # on, because they were removed or concluded by hand, and of frozen
+        # experiments which are frozen no longer. Any experiment reported on
+        # again gets a new schedule. Returns whether any were unfrozen.
+        unfrozen = False
+
+        for name, schedule in list(self.schedules.items()):
+            report = reports.get(name)
+
+            if schedule.frozen:
+                # Frozen experiments are reported on every cycle
+                if report is not None and 'concluded_date' in report:
+                    continue
+
+                unfrozen = True
+            elif report is not None or name in skip:
+                continue
+
+            logger.info("No longer scheduling %s", name)
+            del self.schedules[name]
+            self.results.pop(name, None)
+
+        return unfrozen
+
+    def _failed(self, now):
+        # Nothing was reported on, so every experiment would still be due:
+        # back off exponentially rather than retrying straight away.
+        self.failures += 1
+
+        delay = min(
+            self.min_interval * 2 ** (self.failures - 1),
+            self.max_interval,
+        )
+
+        logger.exception(
+            "Report cycle failed %d times in a row, retrying in %ds",
+            self.failures,
+            delay,
+        )
+
+        for schedule in self.schedules.values():
+            schedule.next_run = max(schedule.next_run, now + delay)
+
+        self._wake(delay)
+
+    def _update(self, name, report, now):
+        try:
+            schedule = self.schedules[name]
+        except KeyError:
+            schedule = self.schedules[name] = ExperimentSchedule(
+                self.min_interval,
+            )
+
+        if 'concluded_date' in report:
+            schedule.frozen = True
+            return
+
+        if name in self.results:
+            schedule.drift = posterior_drift(self.results[name], report)
+
+        schedule.cost = report['cost']
+        schedule.kpi_costs = {
+            kpi['kpi']: kpi['cost']
+            for kpi in report_kpis(report)
+        }
+        schedule.last_run = now
+
+    def _rebalance(self, updated):
+        active = [
+            schedule
+            for schedule in self.schedules.values()
+            if not schedule.frozen and schedule.last_run is not None
+        ]
+
+        # Aim for each refresh to move the posteriors by about
+        # `target_drift` standard deviations.
+        for name in updated:
+            schedule = self.schedules[name]
+
+            if schedule.frozen or not schedule.drift:
+                continue
+
+            drift = max(schedule.drift.values())
+
+            if drift > 0:
+                factor = self.target_drift / drift
+            else:
+                factor = 2
+
+            schedule.interval = min(max(
+                schedule.interval * min(max(factor, 0.5), 2),
+                self.min_interval,
+            ), self.max_interval)
+
+        load = sum(
+            schedule.cost / schedule.interval
+            for schedule in active
+        )
+
+        if load > self.budget:
+            logger.info(
+                "Report load %.2f exceeds budget %.2f, backing off",
+                load,
+                self.budget,
+            )
+
+            for schedule in active:
+                schedule.interval = min(
+                    schedule.interval * load / self.budget,
+                    self.max_interval,
+                )
+
+        for name in updated:
+            schedule = self.schedules[name]
+
+            if not schedule.frozen:
+                schedule.next_run = schedule.last_run + schedule.interval
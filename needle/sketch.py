@@ -0,0 +1,146 @@
+import math
+import numpy
+import collections
+
+
+class QuantileSketch:
+    # Logarithmically bucketed histogram, as in DDSketch. Quantiles are
+    # interpolated within buckets rather than read at DDSketch's single
+    # representative value, so buckets are narrower: every point of a
+    # bucket is within `relative_error` of every value counted in it, and
+    # so is every quantile read from the sketch.
+    # Memory grows with the logarithm of the range of values, not with their
+    # number, and sketches with the same error bound merge by adding counts.
+
+    def __init__(self, relative_error=0.01):
+        if not 0 < relative_error < 1:
+            raise ValueError("Relative error must be between 0 and 1")
+
+        self.relative_error = relative_error
+        self.gamma = 1 + relative_error
+        self.log_gamma = math.log(self.gamma)
+
+        self.positive = collections.Counter()
+        self.negative = collections.Counter()
+        self.zeros = 0
+
+    def __len__(self):
+        return (
+            sum(self.positive.values()) +
+            sum(self.negative.values()) +
+            self.zeros
+        )
+
+    def copy(self):
+        sketch = QuantileSketch(self.relative_error)
+        sketch.merge(self)
+        return sketch
+
+    def merge(self, other):
+        if other.relative_error != self.relative_error:
+            raise ValueError("Cannot merge sketches of different accuracy")
+
+        self.positive.update(other.positive)
+        self.negative.update(other.negative)
+        self.zeros += other.zeros
+
+    def add(self, values):
+        values = numpy.asarray(values, dtype=float)
+
+        self._add_to_store(self.positive, values[values > 0])
+        self._add_to_store(self.negative, -values[values < 0])
+        self.zeros += int(numpy.count_nonzero(values == 0))
+
+    def _add_to_store(self, store, magnitudes):
+        if len(magnitudes) == 0:
+            return
+
+        indices, counts = numpy.unique(
+            numpy.ceil(numpy.log(magnitudes) / self.log_gamma).astype(int),
+            return_counts=True,
+        )
+
+        store.update(dict(zip(indices.tolist(), counts.tolist())))
+
+    def histogram(self):
+        # Bucket bounds in ascending order, with their counts
+        negative_indices = sorted(self.negative, reverse=True)
+        positive_indices = sorted(self.positive)
+
+        bounds = (
+            [(-self.gamma ** x, -self.gamma ** (x - 1))
+             for x in negative_indices] +
+            ([(0.0, 0.0)] if self.zeros else []) +
+            [(self.gamma ** (x - 1), self.gamma ** x)
+             for x in positive_indices]
+        )
+        counts = (
+            [self.negative[x] for x in negative_indices] +
+            ([self.zeros] if self.zeros else []) +
+            [self.positive[x] for x in positive_indices]
+        )
+
+        lower, upper = numpy.array(bounds).reshape(-1, 2).T
+
+        return lower, upper, numpy.array(counts)
+
+    def quantile(self, q):
+        lower, upper, counts = self.histogram()
+
+        if len(counts) == 0:
+            raise ValueError("Quantile of an empty sketch")
+
+        return interpolate_rank(
+            lower,
+            upper,
+            counts,
+            numpy.cumsum(counts),
+            q * counts.sum(),
+        )
+
+
+def interpolate_rank(lower, upper, counts, cumulative_counts, rank):
+    # Find the value at `rank` by interpolating linearly within its bucket;
+    # works on a single histogram or on rows of resampled ones.
+    bucket = numpy.argmax(cumulative_counts >= rank, axis=-1)
+    bucket_counts = numpy.take_along_axis(
+        numpy.broadcast_to(counts, cumulative_counts.shape),
+        numpy.expand_dims(bucket, -1),
+        axis=-1,
+    )[..., 0]
+    bucket_end = numpy.take_along_axis(
+        cumulative_counts,
+        numpy.expand_dims(bucket, -1),
+        axis=-1,
+    )[..., 0]
+
+    fraction = 1 - (bucket_end - rank) / numpy.maximum(bucket_counts, 1)
+
+    return lower[bucket] + fraction * (upper[bucket] - lower[bucket])
+
+
+def bootstrap_medians(sketch, nbootstraps, chunk_size=1000):
+    # Bootstrapping the compressed histogram: each resample redistributes
+    # the same number of values across the buckets.
+    lower, upper, counts = sketch.histogram()
+    total = counts.sum()
+    probabilities = counts / total
+
+    medians = []
+
+    for start in range(0, nbootstraps, chunk_size):
+        resamples = numpy.random.multinomial(
+            total,
+            probabilities,
+            size=min(chunk_size, nbootstraps - start),
+        )
+
+        medians.append(interpolate_rank(
+            lower,
+            upper,
+            resamples,
+            numpy.cumsum(resamples, axis=1),
+            total / 2,
+        ))
+
+    return numpy.concatenate(medians)
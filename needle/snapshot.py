@@ -0,0 +1,87 @@
+import pickle
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+SNAPSHOT_FILE = 'needle.snapshot'
+
+SNAPSHOT_VERSION = 2
+
+
+def source_stats(root, filenames):
+    stats = {}
+
+    for filename in filenames:
+        try:
+            stat = (root / filename).stat()
+        except FileNotFoundError:
+            # Deployed without its sources, which is fine
+            continue
+
+        stats[filename] = (stat.st_mtime_ns, stat.st_size)
+
+    return stats
+
+
+def load_snapshot(root, experiment_filenames):
+    path = root / SNAPSHOT_FILE
+
+    try:
+        with path.open('rb') as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+    if snapshot['version'] != SNAPSHOT_VERSION:
+        logger.warning("Ignoring snapshot %s from another version", path)
+        return None
+
+    stats = source_stats(root, snapshot['sources'])
+
+    if any(
+        snapshot['stats'].get(filename) != stat
+        for filename, stat in stats.items()
+    ):
+        logger.warning("Ignoring stale snapshot %s", path)
+        return None
+
+    # An experiment file added or removed changes the configuration just as
+    # an edit does. With none on disk, the snapshot was deployed without
+    # its sources.
+    if (
+        experiment_filenames and
+        sorted(experiment_filenames) != snapshot['experiment_files']
+    ):
+        logger.warning("Ignoring snapshot %s of other experiment files", path)
+        return None
+
+    return snapshot['sources']
+
+
+def compile_snapshot(root):
+    from .configuration import Configuration  # Lazy-load
+
+    configuration = Configuration(root, use_snapshot=False)
+
+    # Build the KPIs too, so that the snapshot is fully validated
+    logger.debug("Validating %d KPIs", len(configuration.kpis))
+
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'sources': configuration.sources,
+        'stats': source_stats(root, configuration.sources),
+        'experiment_files': sorted(configuration.experiment_files),
+    }
+
+    path = root / SNAPSHOT_FILE
+    temporary_path = path.with_suffix('.tmp')
+
+    with temporary_path.open('wb') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    temporary_path.replace(path)
+
+    logger.info("Wrote snapshot to %s", path)
+
+    return path
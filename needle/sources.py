@@ -0,0 +1,77 @@
+import os
+import yaml
+import pickle
+import hashlib
+import logging
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+
+CACHE_DIRECTORY = '.needle-cache'
+
+# libyaml's loader when PyYAML was built with it, which is many times faster
+Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def load_source(root, filename):
+    path = root / filename
+
+    try:
+        with path.open('rb') as f:
+            content = f.read()
+    except IOError:
+        logger.error("Could not load %s", filename)
+        raise
+
+    digest = hashlib.sha256(content).hexdigest()
+    cache_path = root / CACHE_DIRECTORY / filename
+    cache_path = cache_path.with_name('%s.%s.pickle' % (
+        cache_path.name,
+        digest,
+    ))
+
+    try:
+        with cache_path.open('rb') as f:
+            return pickle.load(f)
+    except (IOError, pickle.UnpicklingError, EOFError):
+        pass
+
+    logger.debug("Parsing %s", filename)
+    source = yaml.load(content, Loader=Loader)
+
+    try:
+        _write_cache(cache_path, path.name, source)
+    except IOError:
+        # The cache is only an optimisation; a read-only root is fine
+        logger.warning("Could not cache %s", filename)
+
+    return source
+
+
+def _write_cache(cache_path, filename, source):
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Entries for previous contents of the same file are of no further use
+    for stale_path in cache_path.parent.glob('%s.*.pickle' % filename):
+        stale_path.unlink()
+
+    temporary_path = cache_path.with_suffix('.tmp')
+
+    with temporary_path.open('wb') as f:
+        pickle.dump(source, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    temporary_path.replace(cache_path)
+
+
+def load_sources(root, filenames):
+    workers = min(len(filenames), os.cpu_count() or 4)
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        sources = executor.map(
+            load_source,
+            (root for x in filenames),
+            filenames,
+        )
+
+        return dict(zip(filenames, sources))
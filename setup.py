@@ -21,7 +21,7 @@ setup(
     url='https://github.com/thread/needle',
     install_requires=(
         'aiohttp >=0.22',
-        'numpy >=1.11, <2',
+        'numpy >=1.15, <2',
         'scipy >=0.18',
         'pyyaml >=3.12, <4',
         'python-dateutil >=2.5',
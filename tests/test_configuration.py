@@ -0,0 +1,138 @@
+import os
+
+import pytest
+
+from needle.configuration import Configuration
+
+
+KPIS = '''
+kpis: {}
+connection: sqlite://
+get-users: SELECT id, date_joined FROM users
+'''
+
+EXPERIMENT = '''
+experiments:
+  - name: {name}
+    start-date: 2016-01-01
+    site-area: {site_area}
+    kpi: conversion
+    minimum-change: 0.01
+    branches:
+      - name: control
+        fraction: {fraction}
+        parameters: {{}}
+      - name: test
+        fraction: {fraction}
+        parameters: {{}}
+'''
+
+
+def write_experiment(root, filename, name, site_area, fraction):
+    path = root / 'experiments.d' / filename
+    path.write_text(EXPERIMENT.format(
+        name=name,
+        site_area=site_area,
+        fraction=fraction,
+    ))
+
+    # Later than any earlier write, however coarse the clock
+    stat = path.stat()
+    os.utime(str(path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+@pytest.fixture
+def root(tmp_path):
+    (tmp_path / 'defaults.yaml').write_text('colour: red\n')
+    (tmp_path / 'kpis.yaml').write_text(KPIS)
+    (tmp_path / 'experiments.d').mkdir()
+
+    write_experiment(tmp_path, 'a.yaml', 'A', 'home', 0.2)
+    write_experiment(tmp_path, 'b.yaml', 'B', 'basket', 0.2)
+
+    return tmp_path
+
+
+def experiment_names(configuration):
+    return sorted(x.name for x in configuration.experiments)
+
+
+def split_points(configuration, site_area):
+    return [x[0] for x in configuration.site_area_splits(site_area)]
+
+
+def test_changed_experiment_files(root):
+    configuration = Configuration(root)
+
+    assert configuration.changed_experiment_files() == set()
+
+    write_experiment(root, 'a.yaml', 'A', 'home', 0.3)
+    write_experiment(root, 'c.yaml', 'C', 'home', 0.1)
+    (root / 'experiments.d' / 'b.yaml').unlink()
+
+    assert configuration.changed_experiment_files() == {
+        'experiments.d/a.yaml',
+        'experiments.d/b.yaml',
+        'experiments.d/c.yaml',
+    }
+
+
+def test_reload_invalidates_only_affected_site_areas(root):
+    configuration = Configuration(root)
+    home_splits = configuration.site_area_splits('home')
+    basket_splits = configuration.site_area_splits('basket')
+
+    write_experiment(root, 'a.yaml', 'A', 'home', 0.4)
+    reloaded = configuration.reload_experiment_files(
+        configuration.changed_experiment_files(),
+    )
+
+    assert split_points(reloaded, 'home') == pytest.approx([0.4, 0.8])
+    assert reloaded.site_area_splits('basket') is basket_splits
+
+    # The original is left as it was for anyone still using it
+    assert configuration.site_area_splits('home') is home_splits
+    assert split_points(configuration, 'home') == pytest.approx([0.2, 0.4])
+
+
+def test_reload_adds_and_removes_files(root):
+    configuration = Configuration(root)
+
+    write_experiment(root, 'c.yaml', 'C', 'home', 0.1)
+    (root / 'experiments.d' / 'b.yaml').unlink()
+
+    reloaded = configuration.reload_experiment_files(
+        configuration.changed_experiment_files(),
+    )
+
+    assert experiment_names(reloaded) == ['A', 'C']
+    assert reloaded.site_areas == {'home'}
+    assert split_points(reloaded, 'home') == pytest.approx(
+        [0.2, 0.4, 0.5, 0.6],
+    )
+    assert reloaded.changed_experiment_files() == set()
+
+    assert experiment_names(configuration) == ['A', 'B']
+
+
+def test_reload_rejects_superunity_coverage(root):
+    configuration = Configuration(root)
+
+    write_experiment(root, 'c.yaml', 'C', 'home', 0.4)
+
+    with pytest.raises(ValueError):
+        configuration.reload_experiment_files({'experiments.d/c.yaml'})
+
+    assert experiment_names(configuration) == ['A', 'B']
+    assert configuration.changed_experiment_files() == {
+        'experiments.d/c.yaml',
+    }
+
+
+def test_reload_rejects_duplicate_names(root):
+    configuration = Configuration(root)
+
+    write_experiment(root, 'c.yaml', 'A', 'basket', 0.1)
+
+    with pytest.raises(ValueError):
+        configuration.reload_experiment_files({'experiments.d/c.yaml'})
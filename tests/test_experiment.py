@@ -0,0 +1,90 @@
+import datetime
+
+import pytest
+
+from needle.experiment import (
+    Experiment,
+    Branch,
+    AnalysisMode,
+    UserClass,
+    user_experiments,
+    split_by_site_area,
+)
+
+
+class FakeConfiguration:
+    # Just enough of a Configuration for user_experiments
+
+    def __init__(self, experiments):
+        self.experiments = experiments
+        self.site_areas = {x.site_area for x in experiments}
+
+    def site_area_splits(self, site_area):
+        return split_by_site_area(site_area, self.experiments)
+
+
+def make_experiment(name, start_date):
+    return Experiment(
+        name=name,
+        description="",
+        confidence=0.95,
+        site_area='home',
+        user_class=UserClass.BOTH,
+        start_date=start_date,
+        branches=[
+            Branch('control', fraction=0.2, parameters={}),
+            Branch('test', fraction=0.2, parameters={}),
+        ],
+        primary_kpi='conversion',
+        minimum_change=0.01,
+        secondary_kpis=(),
+        analysis=AnalysisMode.SEQUENTIAL,
+        mixing_variance=0.0001,
+    )
+
+
+@pytest.fixture
+def configuration():
+    return FakeConfiguration([
+        make_experiment('A', datetime.date(2016, 1, 1)),
+        make_experiment('B', datetime.date(2016, 2, 1)),
+    ])
+
+
+def assignments(configuration):
+    signup_date = datetime.date(2015, 1, 1)
+
+    return {
+        user_id: [
+            (experiment.name, branch.name)
+            for experiment, branch in user_experiments(
+                user_id,
+                signup_date,
+                configuration,
+            )
+        ]
+        for user_id in range(2000)
+    }
+
+
+@pytest.mark.parametrize('conclusion, served', (
+    ({'winning_branch': 'test'}, 'test'),
+    ({'winning_branch': 'control'}, 'control'),
+    ({'winning_branch': 'removed'}, 'control'),
+    ({}, 'control'),
+))
+def test_frozen_experiment_keeps_its_slice(configuration, conclusion, served):
+    before = assignments(configuration)
+
+    configuration.experiments[0].conclusion = conclusion
+
+    after = assignments(configuration)
+
+    for user_id, experiments in before.items():
+        if experiments and experiments[0][0] == 'A':
+            assert after[user_id] == [('A', served)]
+        else:
+            # Including every user of the later experiment B
+            assert after[user_id] == experiments
+
+    assert any(x == [('B', 'test')] for x in after.values())
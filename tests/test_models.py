@@ -0,0 +1,138 @@
+import math
+
+import numpy
+import pytest
+import scipy.stats
+import scipy.integrate
+
+from needle.models import (
+    MedianSketchModel,
+    DistributionDescription,
+    calculate_always_valid_p,
+    describe_scipy_distribution,
+    calculate_sampled_prob_improvement,
+)
+
+
+def exact_prob_improvement(reference, test):
+    # P(test > reference) = E[F_reference(test)]
+    return scipy.integrate.quad(
+        lambda x: test.pdf(x) * reference.cdf(x),
+        0,
+        1,
+        points=(reference.mean(), test.mean()),
+        limit=200,
+    )[0]
+
+
+@pytest.mark.parametrize('reference_successes, test_successes', (
+    (100, 100),
+    (100, 120),
+    (100, 150),
+    (100, 200),
+    (30, 5),
+))
+def test_sampled_prob_improvement_matches_beta(
+    reference_successes,
+    test_successes,
+):
+    reference = scipy.stats.beta(1 + reference_successes, 1000)
+    test = scipy.stats.beta(1 + test_successes, 1000)
+
+    p_positive, p_negative = calculate_sampled_prob_improvement(
+        describe_scipy_distribution(reference),
+        describe_scipy_distribution(test),
+    )
+
+    expected = exact_prob_improvement(reference, test)
+
+    assert p_positive == pytest.approx(expected, abs=1e-3)
+    assert p_negative == pytest.approx(1 - expected, abs=1e-3)
+
+
+@pytest.mark.parametrize('prior, relative_error', (
+    ([90.0, 100.0, 110.0], 0.01),
+    (numpy.array([90.0, 100.0, 110.0]), 0.01),
+    ({'samples': [90.0, 100.0, 110.0]}, 0.01),
+    ({'samples': [90.0, 100.0, 110.0], 'relative-error': 0.05}, 0.05),
+))
+def test_median_sketch_prior_forms(prior, relative_error):
+    model = MedianSketchModel(prior)
+
+    assert len(model.seed_sketch) == 3
+    assert model.seed_sketch.relative_error == relative_error
+
+
+def normal_posterior(mean, std):
+    return DistributionDescription(
+        mean=mean,
+        std=std,
+        skewness=0,
+        percentiles=(),
+        samples=None,
+    )
+
+
+def test_always_valid_p_without_evidence():
+    control = normal_posterior(0.1, 0.01)
+
+    assert calculate_always_valid_p(control, control, 0.0001) == 1
+    assert calculate_always_valid_p(
+        normal_posterior(0.1, 0),
+        normal_posterior(0.2, 0),
+        0.0001,
+    ) == 1
+
+
+def test_always_valid_p_falls_with_effect():
+    control = normal_posterior(0.1, 0.01)
+
+    p_values = [
+        calculate_always_valid_p(
+            control,
+            normal_posterior(0.1 + effect, 0.01),
+            0.0001,
+        )
+        for effect in (0.02, 0.04, 0.06, 0.08)
+    ]
+
+    assert p_values == sorted(p_values, reverse=True)
+    assert p_values[0] > 0.5
+    assert p_values[-1] < 0.01
+
+    # Measured from the minimum effect instead
+    assert calculate_always_valid_p(
+        control,
+        normal_posterior(0.18, 0.01),
+        0.0001,
+        minimum_effect_size=0.08,
+    ) == 1
+
+
+def test_always_valid_p_controls_error_under_peeking():
+    # With no true difference, stopping at the first of many looks with
+    # p < 0.05 must happen in at most 5% of experiments.
+    random = numpy.random.RandomState(0)
+    nexperiments, nlooks, batch = 2000, 100, 50
+
+    observations = random.normal(0, 1, (nexperiments, nlooks * batch))
+    differences = observations[:, 0::2] - observations[:, 1::2]
+    counts = numpy.arange(1, nlooks + 1) * batch // 2
+    means = numpy.cumsum(differences, axis=1)[:, counts - 1] / counts
+
+    stopped = numpy.zeros(nexperiments, dtype=bool)
+
+    for look, count in enumerate(counts):
+        std = math.sqrt(2 / count)
+
+        for experiment in numpy.flatnonzero(~stopped):
+            stopped[experiment] = calculate_always_valid_p(
+                normal_posterior(0, std / math.sqrt(2)),
+                normal_posterior(
+                    means[experiment, look],
+                    std / math.sqrt(2),
+                ),
+                1,
+            ) < 0.05
+
+    assert stopped.mean() <= 0.05
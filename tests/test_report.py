@@ -0,0 +1,126 @@
+import json
+import datetime
+
+import pytest
+
+from needle.report import (
+    get_recommendation,
+    get_winning_branch,
+    run_all_reports,
+)
+from needle.experiment import Experiment, Branch, AnalysisMode, UserClass
+from needle.configuration import Configuration
+
+
+def make_experiment(analysis, confidence=0.95):
+    return Experiment(
+        name='A',
+        description="",
+        confidence=confidence,
+        site_area='home',
+        user_class=UserClass.BOTH,
+        start_date=datetime.date(2016, 1, 1),
+        branches=[
+            Branch('control', fraction=0.2, parameters={}),
+            Branch('test', fraction=0.2, parameters={}),
+        ],
+        primary_kpi='conversion',
+        minimum_change=0.01,
+        secondary_kpis=(),
+        analysis=analysis,
+        mixing_variance=0.0001,
+    )
+
+
+def make_kpi_result(p_positive, p_value=None, **branches):
+    data = {
+        'control': {'p_positive': None, 'p_negative': None, 'p_value': None},
+        'test': {
+            'p_positive': p_positive,
+            'p_negative': 1 - p_positive,
+            'p_value': p_value,
+        },
+    }
+
+    for name, (branch_p_positive, branch_p_value) in branches.items():
+        data[name] = {
+            'p_positive': branch_p_positive,
+            'p_negative': 1 - branch_p_positive,
+            'p_value': branch_p_value,
+        }
+
+    return {'data': data}
+
+
+@pytest.mark.parametrize('p_positive, recommendation', (
+    (0.5, "continue"),
+    (0.9, "continue"),
+    (0.96, "conclude"),
+    (0.04, "continue"),  # Clearly worse, but fixed mode waits
+))
+def test_fixed_recommendation(p_positive, recommendation):
+    # Fixed mode ignores the confidence, and the p-values
+    experiment = make_experiment(AnalysisMode.FIXED, confidence=0.8)
+
+    assert get_recommendation(
+        make_kpi_result(p_positive, p_value=0.0),
+        experiment,
+    ) == recommendation
+
+
+@pytest.mark.parametrize('p_value, confidence, recommendation', (
+    (0.2, 0.95, "continue"),
+    (0.04, 0.95, "conclude"),
+    (0.04, 0.99, "continue"),
+))
+def test_sequential_recommendation(p_value, confidence, recommendation):
+    experiment = make_experiment(AnalysisMode.SEQUENTIAL, confidence)
+
+    assert get_recommendation(
+        make_kpi_result(0.5, p_value=p_value),
+        experiment,
+    ) == recommendation
+
+
+@pytest.mark.parametrize('kpi_result, winner', (
+    (make_kpi_result(0.99, p_value=0.01), 'test'),
+    (make_kpi_result(0.01, p_value=0.01), 'control'),
+    (make_kpi_result(0.99, p_value=0.2), 'control'),
+    (make_kpi_result(0.97, p_value=0.01, other=(0.99, 0.01)), 'other'),
+    (make_kpi_result(0.99, p_value=0.01, other=(0.999, 0.2)), 'test'),
+))
+def test_winning_branch(kpi_result, winner):
+    experiment = make_experiment(AnalysisMode.SEQUENTIAL)
+
+    assert get_winning_branch(kpi_result, experiment) == winner
+
+
+def test_frozen_experiments_reuse_conclusion(tmp_path):
+    (tmp_path / 'defaults.yaml').write_text('colour: red\n')
+    (tmp_path / 'kpis.yaml').write_text(
+        'kpis: {}\n'
+        'connection: sqlite://\n'
+        'get-users: SELECT id, date_joined FROM users\n'
+    )
+    (tmp_path / 'experiments.yaml').write_text(
+        'experiments:\n'
+        '  - name: A\n'
+        '    start-date: 2016-01-01\n'
+        '    site-area: home\n'
+        '    kpi: conversion\n'
+        '    minimum-change: 0.01\n'
+        '    analysis: sequential\n'
+        '    branches:\n'
+        '      - {name: control, fraction: 0.5, parameters: {}}\n'
+        '      - {name: test, fraction: 0.5, parameters: {}}\n'
+    )
+
+    conclusion = {'concluded_date': '2016-10-01', 'winning_branch': 'test'}
+
+    with (tmp_path / 'conclusions.json').open('w') as f:
+        json.dump({'A': conclusion}, f)
+
+    configuration = Configuration(tmp_path)
+
+    # Without touching the database, which does not exist
+    assert run_all_reports(configuration) == {'A': conclusion}
@@ -0,0 +1,196 @@
+import concurrent.futures
+
+import pytest
+
+from needle.scheduler import ReportScheduler
+
+
+class FakeLoop:
+    # Time stands still until advanced, and report cycles finish when the
+    # test says so.
+
+    def __init__(self):
+        self.now = 1000.0
+        self.delays = []
+        self.cycle = None
+
+    def time(self):
+        return self.now
+
+    def call_later(self, delay, callback):
+        self.delays.append(delay)
+        return concurrent.futures.Future()
+
+    def run_in_executor(self, executor, function):
+        self.cycle = concurrent.futures.Future()
+        self.cycle.skip = function.keywords['skip']
+        return self.cycle
+
+
+def run_reports(path, skip=()):
+    raise AssertionError("Cycles are finished by the tests")
+
+
+def make_report(mean=0.0, cost=1.0, concluded=False):
+    report = {
+        'primary': {
+            'kpi': 'conversion',
+            'cost': cost,
+            'data': {'test': {'posterior': {'mean': mean, 'std': 1.0}}},
+        },
+        'secondaries': [],
+        'cost': cost,
+    }
+
+    if concluded:
+        report['concluded_date'] = '2016-10-01'
+
+    return report
+
+
+@pytest.fixture
+def loop():
+    return FakeLoop()
+
+
+@pytest.fixture
+def scheduler(loop):
+    scheduler = ReportScheduler(
+        loop,
+        run_reports,
+        'configuration',
+        {},
+        budget=0.5,
+        min_interval=30,
+        max_interval=3600,
+        target_drift=0.1,
+    )
+
+    yield scheduler
+
+    scheduler.executor.shutdown()
+
+
+def run_cycle(scheduler, loop, reports):
+    scheduler._run()
+    skip = loop.cycle.skip
+    loop.cycle.set_result(reports)
+    return skip
+
+
+def test_first_report_schedules_at_min_interval(scheduler, loop):
+    run_cycle(scheduler, loop, {'A': make_report()})
+
+    schedule = scheduler.schedules['A']
+
+    assert schedule.interval == 30
+    assert schedule.next_run == loop.now + 30
+    assert loop.delays[-1] == 30
+
+
+@pytest.mark.parametrize('drift, interval', (
+    (0.0, 60),     # Still: doubles, at most
+    (0.05, 60),    # Half the target drift
+    (0.1, 30),     # On target
+    (1.0, 30),     # Moving fast, but never below min_interval
+))
+def test_interval_follows_drift(scheduler, loop, drift, interval):
+    run_cycle(scheduler, loop, {'A': make_report(mean=0.0)})
+    loop.now += 30
+    run_cycle(scheduler, loop, {'A': make_report(mean=drift)})
+
+    assert scheduler.schedules['A'].interval == pytest.approx(interval)
+
+
+def test_interval_capped_at_max_interval(scheduler, loop):
+    for cycle in range(10):
+        run_cycle(scheduler, loop, {'A': make_report()})
+        loop.now = scheduler.schedules['A'].next_run
+
+    assert scheduler.schedules['A'].interval == 3600
+
+
+def test_intervals_stretched_over_budget(scheduler, loop):
+    # Two reports costing 15s every 30s: a load of 1, twice the budget
+    run_cycle(scheduler, loop, {
+        'A': make_report(cost=15),
+        'B': make_report(cost=15),
+    })
+
+    assert scheduler.schedules['A'].interval == pytest.approx(60)
+    assert scheduler.schedules['B'].interval == pytest.approx(60)
+
+
+def test_due_experiments_are_not_skipped(scheduler, loop):
+    run_cycle(scheduler, loop, {'A': make_report(), 'B': make_report()})
+
+    scheduler.schedules['B'].next_run = loop.now
+
+    assert run_cycle(scheduler, loop, {'B': make_report()}) == {'A'}
+
+
+def test_refresh_when_idle(scheduler, loop):
+    run_cycle(scheduler, loop, {'A': make_report()})
+
+    scheduler.refresh('A')
+
+    assert scheduler.schedules['A'].next_run == 0
+    assert loop.delays[-1] == 0
+
+
+def test_refresh_during_cycle_applied_after_it(scheduler, loop):
+    run_cycle(scheduler, loop, {'A': make_report(), 'B': make_report()})
+    loop.now += 30
+
+    scheduler._run()
+    scheduler.refresh('A')
+    loop.cycle.set_result({'A': make_report(), 'B': make_report()})
+
+    assert scheduler.schedules['A'].next_run == 0
+    assert scheduler.schedules['B'].next_run > loop.now
+    assert loop.delays[-1] == 0
+    assert not scheduler.pending_refreshes
+
+
+def test_failures_back_off(scheduler, loop):
+    run_cycle(scheduler, loop, {'A': make_report()})
+
+    for delay in (30, 60, 120):
+        scheduler._run()
+        loop.cycle.set_exception(RuntimeError("Database unavailable"))
+
+        assert loop.delays[-1] == delay
+        assert scheduler.schedules['A'].next_run == loop.now + delay
+
+    run_cycle(scheduler, loop, {'A': make_report()})
+
+    assert scheduler.failures == 0
+
+
+def test_frozen_until_conclusion_removed(scheduler, loop):
+    run_cycle(scheduler, loop, {'A': make_report(concluded=True)})
+
+    assert scheduler.schedules['A'].frozen
+    assert run_cycle(scheduler, loop, {
+        'A': make_report(concluded=True),
+    }) == {'A'}
+    assert scheduler.schedules['A'].frozen
+
+    # Removed from conclusions.json: skipped while frozen, so due at once
+    run_cycle(scheduler, loop, {})
+
+    assert 'A' not in scheduler.schedules
+    assert 'A' not in scheduler.results
+    assert loop.delays[-1] == 0
+    assert run_cycle(scheduler, loop, {'A': make_report()}) == set()
+    assert not scheduler.schedules['A'].frozen
+
+
+def test_removed_experiment_unscheduled(scheduler, loop):
+    run_cycle(scheduler, loop, {'A': make_report(), 'B': make_report()})
+    loop.now += 30
+
+    run_cycle(scheduler, loop, {'A': make_report()})
+
+    assert set(scheduler.schedules) == {'A'}
+    assert set(scheduler.results) == {'A'}
@@ -0,0 +1,34 @@
+import math
+
+import numpy
+import pytest
+
+from needle.sketch import QuantileSketch
+
+
+def exact_quantile(sorted_values, q):
+    # The smallest value with at least a fraction `q` of values at or below
+    rank = max(math.ceil(q * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+@pytest.mark.parametrize('relative_error', (0.01, 0.05, 0.2))
+@pytest.mark.parametrize('distribution', (
+    lambda random: random.lognormal(3, 2, 20000),
+    lambda random: random.normal(0, 100, 20000),
+    lambda random: random.poisson(3, 20000),
+))
+def test_quantiles_within_relative_error(relative_error, distribution):
+    values = distribution(numpy.random.RandomState(0)).astype(float)
+
+    sketch = QuantileSketch(relative_error)
+    sketch.add(values)
+
+    values.sort()
+
+    for q in numpy.linspace(0, 1, 201):
+        exact = exact_quantile(values, q)
+
+        assert abs(sketch.quantile(q) - exact) <= (
+            relative_error * abs(exact) * (1 + 1e-9)
+        )